@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   bencode.py
+@Time    :   2026/10/18 14:48:10
+@Version :   1.0
+@Desc    :   bencode编解码与种子文件(metainfo)解析
+"""
+
+import hashlib
+from typing import Any, List, Tuple
+
+from pydantic import BaseModel
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def decode(data: bytes) -> Any:
+    """
+    解码bencode数据，字符串保持为bytes，dict的key也是bytes
+    """
+    value, pos = _decode(data, 0)
+    if pos != len(data):
+        raise BencodeError(f"trailing data at {pos}")
+    return value
+
+
+def encode(obj: Any) -> bytes:
+    """
+    编码为bencode，dict按key排序
+    """
+    parts: List[bytes] = []
+    _encode(obj, parts)
+    return b"".join(parts)
+
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    try:
+        token = data[pos : pos + 1]
+        if token == b"i":
+            end = data.index(b"e", pos)
+            return int(data[pos + 1 : end]), end + 1
+        if token == b"l":
+            pos += 1
+            items = []
+            while data[pos : pos + 1] != b"e":
+                item, pos = _decode(data, pos)
+                items.append(item)
+            return items, pos + 1
+        if token == b"d":
+            pos += 1
+            result = {}
+            while data[pos : pos + 1] != b"e":
+                key, pos = _decode(data, pos)
+                if not isinstance(key, bytes):
+                    raise BencodeError(f"dict key must be a string at {pos}")
+                result[key], pos = _decode(data, pos)
+            return result, pos + 1
+        if token.isdigit():
+            colon = data.index(b":", pos)
+            start = colon + 1
+            end = start + int(data[pos:colon])
+            if end > len(data):
+                raise BencodeError(f"string out of range at {pos}")
+            return data[start:end], end
+    except (ValueError, IndexError) as e:
+        if isinstance(e, BencodeError):
+            raise
+        raise BencodeError(f"invalid bencode at {pos}") from e
+    raise BencodeError(f"unexpected token {token!r} at {pos}")
+
+
+def _encode(obj: Any, parts: List[bytes]):
+    if isinstance(obj, bool):
+        raise BencodeError("cannot encode bool")
+    if isinstance(obj, int):
+        parts.append(b"i%de" % obj)
+    elif isinstance(obj, str):
+        _encode(obj.encode("utf-8"), parts)
+    elif isinstance(obj, bytes):
+        parts.append(b"%d:" % len(obj))
+        parts.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        parts.append(b"l")
+        for item in obj:
+            _encode(item, parts)
+        parts.append(b"e")
+    elif isinstance(obj, dict):
+        parts.append(b"d")
+        items = [
+            (k.encode("utf-8") if isinstance(k, str) else k, v) for k, v in obj.items()
+        ]
+        for key, value in sorted(items):
+            _encode(key, parts)
+            _encode(value, parts)
+        parts.append(b"e")
+    else:
+        raise BencodeError(f"cannot encode {type(obj).__name__}")
+
+
+def info_span(data: bytes) -> Tuple[int, int]:
+    """
+    种子文件中info字典原始字节的位置，infohash要对原始字节计算，
+    不能对解码后重新编码的结果计算(部分种子的key没有排序)
+    """
+    if data[:1] != b"d":
+        raise BencodeError("metainfo must be a dict")
+    pos = 1
+    while data[pos : pos + 1] != b"e":
+        key, pos = _decode(data, pos)
+        start = pos
+        _, pos = _decode(data, pos)
+        if key == b"info":
+            return start, pos
+    raise BencodeError("metainfo has no info dict")
+
+
+class TorrentMetainfo(BaseModel):
+    name: str
+    infohash: str  # v1 infohash，qb中种子的hash
+    file_sizes: List[int]  # 按qb中文件index顺序排列的文件大小
+
+    @property
+    def size(self) -> int:
+        return sum(self.file_sizes)
+
+
+def parse_metainfo(content: bytes) -> TorrentMetainfo:
+    """
+    解析种子文件，得到infohash和文件列表
+
+    BEP47的填充文件在qb中不显示也不占用文件index，这里同样跳过；
+    只有 file tree 的纯v2种子不支持，抛出 BencodeError
+    """
+    start, end = info_span(content)
+    info = decode(content[start:end])
+    if not isinstance(info, dict):
+        raise BencodeError("info must be a dict")
+
+    if b"files" in info:
+        file_sizes = [
+            file[b"length"]
+            for file in info[b"files"]
+            if b"p" not in file.get(b"attr", b"")
+        ]
+    elif b"length" in info:
+        file_sizes = [info[b"length"]]
+    else:
+        raise BencodeError("v2-only torrents are not supported")
+
+    return TorrentMetainfo(
+        name=info.get(b"name", b"").decode("utf-8", "replace"),
+        infohash=hashlib.sha1(content[start:end]).hexdigest(),
+        file_sizes=file_sizes,
+    )
+
+
+def plan_skipped_files(file_sizes: List[int], max_size: int) -> Tuple[List[int], int]:
+    """
+    按文件顺序依次跳过文件，直到剩余文件的总大小不超过 max_size
+
+    返回 (跳过的文件位置, 剩余文件的总大小)
+    """
+    current_size = sum(file_sizes)
+    skipped = []
+    for index, size in enumerate(file_sizes):
+        if current_size <= max_size:
+            break
+        skipped.append(index)
+        current_size -= size
+    return skipped, current_size
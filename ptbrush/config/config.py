@@ -1,6 +1,8 @@
+from functools import cached_property
 from pathlib import Path
 import shutil
-from typing import List, Optional, Tuple, Type, Union
+import threading
+from typing import Callable, List, Literal, Optional, Tuple, Type, Union
 from loguru import logger
 from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import (
@@ -27,6 +29,24 @@ class SiteModel(BaseModel):
     cookie: Optional[str] = ""
     headers: Optional[List[HeaderParam]] = []
 
+    # 与站点保持的keep-alive连接数上限
+    pool_size: int = Field(default=4, ge=1)
+    # 网络错误或5xx响应时的最大重试次数
+    max_retries: int = Field(default=3, ge=0)
+    # 重试的初始等待时间，单位秒，每次重试翻倍
+    retry_backoff: float = Field(default=1.0, ge=0)
+    # 每分钟最多请求次数，搜索、获取下载链接、下载种子共用
+    rate_limit: float = Field(default=6, gt=0)
+    # 空闲后允许连续发出的请求数
+    rate_burst: int = Field(default=3, ge=1)
+    # 同时进行的分类搜索数
+    search_concurrency: int = Field(default=3, ge=1)
+    # 按时间排序的分类最多翻的页数，一页中刷流候选的占比低于min_page_yield时提前停止
+    max_search_pages: int = Field(default=3, ge=1)
+    min_page_yield: float = Field(default=0.3, ge=0, le=1)
+    # 评分不低于此值的free种子才算刷流候选
+    candidate_min_score: int = Field(default=1, ge=0)
+
 
 class QBConfig(BaseModel):
     url: str
@@ -138,7 +158,24 @@ class BrushConfig(BaseModel):
     min_disk_space: Union[str, int] = 1024 * 1024 * 1024 * 1024
 
     # PT站种子抓取间隔，单位分钟，默认30分钟
-    pt_fetch_interval: int = 30
+    # 每次只增量抓取上次之后发布的新种子
+    pt_fetch_interval: int = Field(default=30, ge=1)
+
+    # PT站全量刷新间隔，单位分钟，默认120分钟
+    # 全量刷新会重新搜索所有分类(包括排行榜)，更新已有种子的做种数和下载数
+    pt_full_refresh_interval: int = Field(default=120, ge=1)
+
+    # 以下各任务的执行间隔修改后无需重启，会在配置文件保存后自动生效
+    # 刷流任务间隔，单位分钟，默认10分钟
+    brush_interval: int = Field(default=10, ge=1)
+    # QB状态采样间隔，单位秒，默认15秒
+    qb_status_interval: int = Field(default=15, ge=1)
+    # QB种子状态采样间隔，单位秒，默认60秒
+    qb_torrents_interval: int = Field(default=60, ge=1)
+    # 清理长时间无活跃种子的检查间隔，单位分钟，默认3分钟
+    clean_interval: int = Field(default=3, ge=1)
+    # 磁盘空间检查间隔，单位分钟，默认5分钟
+    disk_check_interval: int = Field(default=5, ge=1)
 
     # 位于活跃状态的种子数上限，当qb中种子总数（ptbrush分类）大于此值时不会添加新的任务
     max_active_torrents: int = 6
@@ -170,6 +207,10 @@ class BrushConfig(BaseModel):
     # 允许种子最大的无活跃(无下载也无上传)时间，超过此时间将会被删除，单位为:分钟，默认10分钟
     max_no_activate_time: int = 10
 
+    # 本地种子文件缓存的大小上限，超出后删除最久未使用的种子文件，支持单位如 "200MiB"，0表示不缓存
+    # 缓存命中时添加种子不再请求站点的下载链接以及种子文件
+    torrent_cache_size: Union[str, int] = 200 * 1024 * 1024
+
     # 工作时间范围，格式如: "1-4" 表示1:00-4:59, "20-23,0-6" 表示20:00-23:59和0:00-6:59
     # 留空则表示24小时工作
     work_time: str = "1-3"
@@ -202,6 +243,13 @@ class BrushConfig(BaseModel):
         except ValueError as e:
             raise ValueError(f"Invalid torrent_max_size value: {e}")
 
+    @field_validator("torrent_cache_size")
+    def validate_torrent_cache_size(cls, v):
+        try:
+            return parse_size(v)
+        except ValueError as e:
+            raise ValueError(f"Invalid torrent_cache_size value: {e}")
+
     @field_validator("work_time")
     def validate_work_time(cls, v):
         try:
@@ -210,20 +258,52 @@ class BrushConfig(BaseModel):
         except ValueError as e:
             raise ValueError(f"Invalid work_time value: {e}")
 
+    @cached_property
+    def work_time_ranges(self) -> list[tuple[time, time]]:
+        """work_time parsed once per config instance"""
+        return parse_time_ranges(self.work_time)
+
     def is_work_time(self) -> bool:
         """Check if current time is in work time ranges"""
         if not self.work_time:
             return True
 
         now = datetime.datetime.now().time()
-        ranges = parse_time_ranges(self.work_time)
-        return any(start <= now <= end for start, end in ranges)
+        return any(start <= now <= end for start, end in self.work_time_ranges)
+
+
+class WebConfig(BaseModel):
+    # web服务模式:
+    # - "development" 使用Flask自带的开发服务器
+    # - "production" 使用waitress多线程WSGI服务器，调度任务运行时界面也能及时响应
+    server: Literal["development", "production"] = "development"
+
+    # production模式下处理页面和接口请求的工作线程数，
+    # 实时推送连接另外预留 max_streams 个线程，不占用这里的线程
+    threads: int = Field(default=8, ge=1)
+
+    # production模式下的最大连接数
+    connection_limit: int = 100
+
+    # keep-alive空闲连接的超时时间，单位秒
+    channel_timeout: int = 120
+
+    # 同时打开的实时推送(SSE)连接数上限，每个连接会一直占用一个工作线程，
+    # 超出后页面改为定时轮询
+    max_streams: int = Field(default=4, ge=0)
+
+    # 是否对JSON、HTML等动态响应进行gzip压缩，静态文件不压缩，依靠浏览器缓存
+    gzip: bool = True
+
+    # 静态文件(bootstrap.min.css、chart.js等)的浏览器缓存时间，单位秒，默认1天
+    static_max_age: int = 86400
 
 
 class PTBrushConfig(BaseSettings):
     downloader: Optional[QBConfig] = None
     sites: Optional[List[SiteModel]] = []
     brush: Optional[BrushConfig] = BrushConfig()
+    web: Optional[WebConfig] = WebConfig()
 
     model_config = SettingsConfigDict(toml_file=str(CONFIG_FILE_PATH))
 
@@ -261,6 +341,82 @@ class PTBrushConfig(BaseSettings):
         logger.info(f"已覆盖配置文件：{CONFIG_FILE_PATH.absolute()}")
 
 
+class ConfigProvider:
+    """
+    进程内共享的配置
+
+    配置文件只在修改时间或大小变化后才重新读取和校验，调度任务、web接口等
+    高频路径直接使用缓存的配置对象。web界面保存配置后调用 invalidate 立即生效。
+    """
+
+    def __init__(self, path: Path = CONFIG_FILE_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        self._config: Optional[PTBrushConfig] = None
+        self._signature = None
+        self._listeners: List[Callable[[PTBrushConfig, PTBrushConfig], None]] = []
+
+    def get(self) -> PTBrushConfig:
+        signature = self._file_signature()
+        config = self._config
+        if config is not None and signature == self._signature:
+            return config
+
+        with self._lock:
+            old = self._config
+            if self._config is None or signature != self._signature:
+                self._reload(signature)
+            new = self._config
+
+        if old is not None and new is not old:
+            self._notify(old, new)
+        return new
+
+    def add_listener(self, callback: Callable[[PTBrushConfig, PTBrushConfig], None]):
+        """
+        订阅配置变化，配置重新加载后以 (旧配置, 新配置) 调用
+        """
+        self._listeners.append(callback)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def _reload(self, signature):
+        try:
+            config = PTBrushConfig()
+        except Exception as e:
+            if self._config is None:
+                raise
+            # 配置文件有误时继续使用上一次的配置，修改正确后自动生效
+            logger.error(f"配置文件校验失败，继续使用之前的配置: {e}")
+            self._signature = signature
+            return
+        self._config = config
+        self._signature = signature
+
+    def _notify(self, old: PTBrushConfig, new: PTBrushConfig):
+        for callback in self._listeners:
+            try:
+                callback(old, new)
+            except Exception as e:
+                logger.error(f"应用新配置失败: {e}")
+
+    def _file_signature(self):
+        try:
+            stat = self._path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+config_provider = ConfigProvider()
+
+
+def get_config() -> PTBrushConfig:
+    return config_provider.get()
+
+
 if __name__ == "__main__":
     e = PTBrushConfig()
     e.brush.is_work_time()
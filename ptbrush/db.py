@@ -8,12 +8,32 @@
 """
 
 # here put the import lib
+import atexit
 from datetime import datetime, timedelta
 from pathlib import Path
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Type
 import peewee
 from loguru import logger
 
-database = peewee.SqliteDatabase(str(Path(__file__).parent / "data" / "ptbrush.db"))
+database = peewee.SqliteDatabase(
+    str(Path(__file__).parent / "data" / "ptbrush.db"),
+    pragmas={
+        # WAL模式下读写互不阻塞，web界面读取时不会被调度任务的写入卡住
+        "journal_mode": "wal",
+        # WAL模式下NORMAL即可保证一致性，只在checkpoint时fsync
+        "synchronous": "normal",
+        # 页缓存64MiB (负数单位为KiB)
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+        # 遇到写锁时最多等待5秒，而不是直接抛出 database is locked
+        "busy_timeout": 5000,
+    },
+)
 
 
 class BaseModel(peewee.Model):
@@ -38,6 +58,14 @@ class Torrent(BaseModel):
 
     brushed = peewee.BooleanField(default=False, index=True)
 
+    # 刷流中的最新状态，由qb种子采样任务更新，避免每次都扫描BrushTorrent历史
+    # 最后一次有上传或下载速度的时间，刚开始刷流时为第一次采样时间
+    last_active_at = peewee.DateTimeField(null=True)
+    last_upspeed = peewee.IntegerField(default=0)
+    last_dlspeed = peewee.IntegerField(default=0)
+    last_up_total = peewee.BigIntegerField(default=0)
+    last_dl_total = peewee.BigIntegerField(default=0)
+
     class Meta:
         # torrend_id和site联合唯一索引
         indexes = ((("torrent_id", "site"), True),)
@@ -51,6 +79,10 @@ class BrushTorrent(BaseModel):
     dl_total_size = peewee.BigIntegerField(default=0)  # 下载总大小
     dlspeed = peewee.IntegerField(default=0)  # 当前下载速度
 
+    class Meta:
+        # 按种子查询最新采样以及按时间范围聚合
+        indexes = ((("torrent", "created_time"), False),)
+
 
 class QBStatus(BaseModel):
     dlspeed = peewee.IntegerField(default=0)  # 当前下载速度
@@ -60,12 +92,417 @@ class QBStatus(BaseModel):
     dl_total_size = peewee.BigIntegerField(default=0)  # 下载总大小
     free_space_size = peewee.BigIntegerField(default=0)  # 剩余磁盘空间
 
+    class Meta:
+        # 原始数据按时间范围查询以及过期清理
+        indexes = ((("created_time",), False),)
+
+
+class RollupModel(BaseModel):
+    """
+    时序数据降采样后的聚合桶
+    """
+
+    resolution = peewee.IntegerField()  # 桶大小，单位秒
+    bucket_start = peewee.DateTimeField()  # 桶开始时间
+    samples = peewee.IntegerField(default=0)  # 桶内原始采样数
+
+    upspeed_min = peewee.IntegerField(default=0)
+    upspeed_max = peewee.IntegerField(default=0)
+    upspeed_avg = peewee.FloatField(default=0)
+    dlspeed_min = peewee.IntegerField(default=0)
+    dlspeed_max = peewee.IntegerField(default=0)
+    dlspeed_avg = peewee.FloatField(default=0)
+
+    # 桶内第一个和最后一个采样的累计流量
+    up_total_first = peewee.BigIntegerField(default=0)
+    up_total_last = peewee.BigIntegerField(default=0)
+    dl_total_first = peewee.BigIntegerField(default=0)
+    dl_total_last = peewee.BigIntegerField(default=0)
+
+
+class QBStatusRollup(RollupModel):
+    free_space_size = peewee.BigIntegerField(default=0)  # 桶内最后一次的剩余磁盘空间
+
+    class Meta:
+        indexes = ((("resolution", "bucket_start"), True),)
+
+
+class BrushTorrentRollup(RollupModel):
+    torrent = peewee.ForeignKeyField(Torrent, backref="rollups")
+
+    class Meta:
+        indexes = (
+            (("torrent", "resolution", "bucket_start"), True),
+            (("resolution", "bucket_start"), False),
+        )
+
+
+class SiteWatermark(BaseModel):
+    """
+    站点每个搜索分类的抓取水位
+    """
+
+    site = peewee.CharField()
+    category = peewee.CharField()
+    # 已抓取到的最新种子
+    newest_torrent_id = peewee.BigIntegerField(null=True)
+    newest_created_time = peewee.DateTimeField(null=True)
+    # 上一次全量搜索的时间，全量搜索会刷新已有种子的做种数和下载数
+    last_full_refresh = peewee.DateTimeField(null=True)
+
+    # 翻页深度统计，用于观察自适应翻页的效果
+    searches = peewee.IntegerField(default=0)  # 成功的搜索次数
+    last_depth = peewee.IntegerField(default=0)  # 上一次搜索的页数
+    avg_depth = peewee.FloatField(default=0)  # 搜索页数的指数移动平均
+    last_items = peewee.IntegerField(default=0)  # 上一次扫描的种子数
+    last_candidates = peewee.IntegerField(default=0)  # 上一次找到的刷流候选数
+    avg_yield = peewee.FloatField(default=0)  # 每页刷流候选数的指数移动平均
+
+    class Meta:
+        indexes = ((("site", "category"), True),)
+
+
+class TorrentFileCache(BaseModel):
+    """
+    本地种子文件缓存的索引，文件按内容的sha1存放，多个种子可以指向同一个文件
+    """
+
+    site = peewee.CharField()
+    torrent_id = peewee.CharField()
+    sha1 = peewee.CharField(index=True)
+    size = peewee.IntegerField(default=0)
+    last_used = peewee.DateTimeField(default=datetime.now, index=True)
+
+    class Meta:
+        indexes = ((("site", "torrent_id"), True),)
+
+
+class TorrentEvent(BaseModel):
+    """
+    添加/删除刷流种子的事件，Dashboard按周期统计添加和删除的种子数
+
+    与日志分开保存，不受日志清理的影响，超出统计周期的记录由时序数据清理任务删除
+    """
+
+    category = peewee.CharField()  # ADD_TORRENT, DELETE_TORRENT
+    name = peewee.CharField(default="")
+
+    class Meta:
+        indexes = ((("category", "created_time"), False),)
+
 
 class SystemMessage(BaseModel):
     message_type = peewee.CharField(index=True)  # INFO, SUCCESS, WARNING, ERROR
     category = peewee.CharField(index=True)  # ADD_TORRENT, DELETE_TORRENT, SYSTEM
     content = peewee.TextField()
 
+    class Meta:
+        # 日志按 (created_time, id) 倒序分页，筛选级别或分类时也能直接走索引
+        indexes = (
+            (("created_time",), False),
+            (("category", "created_time"), False),
+            (("message_type", "created_time"), False),
+        )
+
+
+# SystemMessage.content 的全文索引，使用trigram分词以支持中文子串搜索
+# SQLite未编译FTS5或版本过低(<3.34)时不可用，搜索退回LIKE
+LOG_FTS_TABLE = "systemmessage_fts"
+log_fts_available = False
+
+
+def setup_log_fts():
+    """
+    创建日志全文索引以及同步触发器，首次创建时导入已有日志
+    """
+    global log_fts_available
+    exists = database.execute_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (LOG_FTS_TABLE,),
+    ).fetchone()
+    try:
+        with database.atomic():
+            database.execute_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {LOG_FTS_TABLE} USING fts5("
+                "content, content='systemmessage', content_rowid='id', "
+                "tokenize='trigram')"
+            )
+            database.execute_sql(
+                f"CREATE TRIGGER IF NOT EXISTS systemmessage_fts_ai "
+                f"AFTER INSERT ON systemmessage BEGIN "
+                f"INSERT INTO {LOG_FTS_TABLE}(rowid, content) "
+                f"VALUES (new.id, new.content); END"
+            )
+            database.execute_sql(
+                f"CREATE TRIGGER IF NOT EXISTS systemmessage_fts_ad "
+                f"AFTER DELETE ON systemmessage BEGIN "
+                f"INSERT INTO {LOG_FTS_TABLE}({LOG_FTS_TABLE}, rowid, content) "
+                f"VALUES ('delete', old.id, old.content); END"
+            )
+            if not exists:
+                database.execute_sql(
+                    f"INSERT INTO {LOG_FTS_TABLE}({LOG_FTS_TABLE}) VALUES ('rebuild')"
+                )
+        log_fts_available = True
+    except peewee.OperationalError as e:
+        log_fts_available = False
+        logger.warning(f"SQLite不支持FTS5 trigram全文索引，日志搜索将使用LIKE: {e}")
+
+
+def log_search_condition(keyword: str) -> peewee.Expression:
+    """
+    日志内容搜索条件，trigram索引只能匹配3个字符及以上的关键字
+    """
+    if log_fts_available and len(keyword) >= 3:
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        return SystemMessage.id.in_(
+            peewee.SQL(
+                f"(SELECT rowid FROM {LOG_FTS_TABLE} WHERE {LOG_FTS_TABLE} MATCH ?)",
+                [phrase],
+            )
+        )
+    return SystemMessage.content.contains(keyword)
+
+
+class BatchWriter:
+    """
+    单线程批量写入器
+
+    各个调度任务、web线程以及日志sink只把要插入的行放入队列，由后台线程合并成
+    insert_many 在一个事务中写入，避免多个线程同时抢写锁。
+    队列中积累到 batch_size 条或距第一条超过 flush_interval 秒时写入一次。
+    队列有上限，日志等可丢弃的数据在队列满时直接丢弃并计数，不会阻塞调用方。
+
+    数据库被锁等临时错误时整批重试，重试 max_retries 次后放弃其中的日志，
+    采样数据和事件消息继续重试直到写入成功，不会丢失。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        maxsize: int = 20000,
+        max_retries: int = 5,
+        retry_backoff: float = 0.2,
+        max_backoff: float = 5.0,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # 队列满被丢弃的行数，total为累计值，pending为还未写入告警日志的部分
+        self.dropped_total = 0
+        self._dropped_pending = 0
+        self.written_total = 0
+
+        # 写入成功后的回调，在写入线程中调用，参数为本批写入的 (model, row) 列表
+        self._subscribers: List[Callable[[List[Tuple[Type[peewee.Model], dict]]], None]] = []
+
+    def subscribe(
+        self, callback: Callable[[List[Tuple[Type[peewee.Model], dict]]], None]
+    ):
+        """
+        订阅写入事件，用于在数据落库后增量更新统计等派生数据
+        """
+        self._subscribers.append(callback)
+
+    def insert(self, model: Type[peewee.Model], **row):
+        """
+        异步插入一行，created_time 在入队时确定，队列满时阻塞等待
+        """
+        row.setdefault("created_time", datetime.now())
+        self._ensure_started()
+        self._queue.put((model, row, False))
+
+    def insert_nowait(self, model: Type[peewee.Model], **row) -> bool:
+        """
+        异步插入一行，队列满时丢弃并计数，返回是否入队成功
+        """
+        row.setdefault("created_time", datetime.now())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((model, row, True))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped_total += 1
+                self._dropped_pending += 1
+            return False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "written": self.written_total,
+            "dropped": self.dropped_total,
+        }
+
+    def flush(self):
+        """
+        阻塞直到队列中已有的数据全部写入
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            rows = list(items)
+            with self._lock:
+                dropped, self._dropped_pending = self._dropped_pending, 0
+            if dropped:
+                rows.append(
+                    (
+                        SystemMessage,
+                        dict(
+                            message_type="WARNING",
+                            category="SYSTEM",
+                            content=f"数据库写入队列已满，丢弃了{dropped}条日志",
+                            created_time=datetime.now(),
+                        ),
+                        True,
+                    )
+                )
+
+            written = self._write_with_retry(rows)
+            if written:
+                self.written_total += len(written)
+                self._notify([(model, row) for model, row, _ in written])
+            for _ in items:
+                self._queue.task_done()
+
+    def _notify(self, rows: List[Tuple[Type[peewee.Model], dict]]):
+        for callback in self._subscribers:
+            try:
+                callback(rows)
+            except Exception as e:
+                report_db_error(f"subscriber {callback!r} failed on {len(rows)} rows", e)
+
+    def _write_with_retry(
+        self, items: List[Tuple[Type[peewee.Model], dict, bool]]
+    ) -> List[Tuple[Type[peewee.Model], dict, bool]]:
+        """
+        写入一批数据，返回实际写入的行
+        """
+        attempt = 0
+        while items:
+            try:
+                self._write([(model, row) for model, row, _ in items])
+                return items
+            except peewee.OperationalError as e:
+                if not _is_transient_error(e):
+                    return self._write_each(items, e)
+                attempt += 1
+                if attempt == self.max_retries:
+                    kept = [item for item in items if not item[2]]
+                    if len(kept) < len(items):
+                        self._count_dropped(len(items) - len(kept))
+                        report_db_error(
+                            f"gave up on {len(items) - len(kept)} log rows after "
+                            f"{attempt} attempts, retrying {len(kept)} rows",
+                            e,
+                        )
+                        items = kept
+                        if not items:
+                            break
+                time.sleep(min(self.retry_backoff * 2 ** (attempt - 1), self.max_backoff))
+            except Exception as e:
+                return self._write_each(items, e)
+        return []
+
+    def _write_each(
+        self, items: List[Tuple[Type[peewee.Model], dict, bool]], error: Exception
+    ) -> List[Tuple[Type[peewee.Model], dict, bool]]:
+        """
+        整批写入出现非临时性错误时逐行写入，只放弃本身有问题的行
+        """
+        report_db_error(f"batch of {len(items)} rows failed, writing row by row", error)
+        written = []
+        for model, row, droppable in items:
+            try:
+                self._write([(model, row)])
+                written.append((model, row, droppable))
+            except Exception as e:
+                if droppable:
+                    self._count_dropped(1)
+                report_db_error(f"failed to write {model.__name__} row {row!r}", e)
+        return written
+
+    def _count_dropped(self, count: int):
+        # 写入失败放弃的日志只计入累计值，不再生成告警日志，避免反复写入失败
+        with self._lock:
+            self.dropped_total += count
+
+    def _write(self, items: List[Tuple[Type[peewee.Model], dict]]):
+        # 按表以及字段分组，保证同一个 insert_many 中各行字段一致
+        groups: Dict[Tuple[Type[peewee.Model], Tuple[str, ...]], List[dict]] = {}
+        for model, row in items:
+            groups.setdefault((model, tuple(sorted(row))), []).append(row)
+
+        with database.atomic():
+            for (model, _), rows in groups.items():
+                for batch in peewee.chunked(rows, 100):
+                    model.insert_many(batch).execute()
+
+
+def _is_transient_error(error: peewee.OperationalError) -> bool:
+    """
+    数据库被锁或繁忙，稍后重试可以成功
+    """
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def report_db_error(context: str, error: Exception):
+    """
+    写入相关的错误直接输出到标准错误，这里不能使用logger，否则错误日志又会进入写入队列
+    """
+    print(
+        f"{datetime.now():%Y-%m-%d %H:%M:%S} | db-writer | {context}: "
+        f"{type(error).__name__}: {error}",
+        file=sys.__stderr__,
+        flush=True,
+    )
+
+
+db_writer = BatchWriter()
+atexit.register(db_writer.flush)
+
+
+def optimize_database():
+    """
+    定期维护数据库：更新查询规划统计信息，并把WAL文件合并回主库
+    替代之前的 VACUUM，后者会重写整个数据库文件并长时间持有锁
+    """
+    database.execute_sql("PRAGMA optimize;")
+    database.execute_sql("PRAGMA wal_checkpoint(TRUNCATE);")
+
 
 def db_log_sink(message):
     """Loguru sink for writing logs to database"""
@@ -79,36 +516,85 @@ def db_log_sink(message):
     # Map log levels to our message types
     # ERROR -> ERROR, WARNING -> WARNING, INFO, CAUTION/SUCCESS map if needed
 
+    # 只入队不等待，队列满时丢弃，保证日志不会阻塞调度任务
     try:
-        SystemMessage.create(
+        db_writer.insert_nowait(
+            SystemMessage,
             message_type=level,
             category=category,
             content=content,
-            # created_time uses default datetime.now
+            created_time=record["time"].replace(tzinfo=None),
         )
     except Exception as e:
         # Avoid infinite loop if DB fails
-        print(f"Failed to log to DB: {e}")
+        report_db_error(f"failed to queue {level} log message", e)
 
 
 def migrate_database():
     """执行数据库迁移，添加缺少的字段"""
     try:
+        has_torrent_event = database.table_exists(TorrentEvent._meta.table_name)
         # 创建表（如果不存在）
-        database.create_tables([Torrent, BrushTorrent, QBStatus, SystemMessage])
+        database.create_tables(
+            [
+                Torrent,
+                BrushTorrent,
+                QBStatus,
+                SystemMessage,
+                QBStatusRollup,
+                BrushTorrentRollup,
+                SiteWatermark,
+                TorrentFileCache,
+                TorrentEvent,
+            ]
+        )
 
-        # 检查QBStatus表是否有free_space_size字段
-        cursor = database.execute_sql("PRAGMA table_info(qbstatus)")
-        columns = [column[1] for column in cursor.fetchall()]
+        if not has_torrent_event:
+            # 之前的统计数据来自日志，升级时把日志中还保留的事件导入事件表
+            TorrentEvent.insert_from(
+                SystemMessage.select(
+                    SystemMessage.category,
+                    SystemMessage.content,
+                    SystemMessage.created_time,
+                    SystemMessage.created_time,
+                ).where(SystemMessage.category.in_(["ADD_TORRENT", "DELETE_TORRENT"])),
+                [
+                    TorrentEvent.category,
+                    TorrentEvent.name,
+                    TorrentEvent.created_time,
+                    TorrentEvent.updated_time,
+                ],
+            ).execute()
 
-        # 如果没有free_space_size字段，添加它
-        if "free_space_size" not in columns:
-            logger.info("正在升级数据库：添加 free_space_size 字段到 QBStatus 表")
+        # 需要补充的字段: (表名, 字段名, 字段定义)
+        columns_to_add = [
+            ("qbstatus", "free_space_size", "BIGINT DEFAULT 0"),
+            ("torrent", "last_active_at", "DATETIME"),
+            ("torrent", "last_upspeed", "INTEGER DEFAULT 0"),
+            ("torrent", "last_dlspeed", "INTEGER DEFAULT 0"),
+            ("torrent", "last_up_total", "BIGINT DEFAULT 0"),
+            ("torrent", "last_dl_total", "BIGINT DEFAULT 0"),
+            ("sitewatermark", "searches", "INTEGER DEFAULT 0"),
+            ("sitewatermark", "last_depth", "INTEGER DEFAULT 0"),
+            ("sitewatermark", "avg_depth", "REAL DEFAULT 0"),
+            ("sitewatermark", "last_items", "INTEGER DEFAULT 0"),
+            ("sitewatermark", "last_candidates", "INTEGER DEFAULT 0"),
+            ("sitewatermark", "avg_yield", "REAL DEFAULT 0"),
+        ]
+        for table, column, definition in columns_to_add:
+            cursor = database.execute_sql(f"PRAGMA table_info({table})")
+            columns = [column_info[1] for column_info in cursor.fetchall()]
+            if column in columns:
+                continue
+
+            logger.info(f"正在升级数据库：添加 {column} 字段到 {table} 表")
             with database.atomic():
                 database.execute_sql(
-                    "ALTER TABLE qbstatus ADD COLUMN free_space_size BIGINT DEFAULT 0"
+                    f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
                 )
 
+        setup_log_fts()
+
         logger.info("数据库升级/检查完成")
     except Exception as e:
         logger.error(f"数据库迁移失败: {str(e)}")
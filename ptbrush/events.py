@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   events.py
+@Time    :   2026/10/18 11:03:17
+@Version :   1.0
+@Desc    :   Web界面的实时推送(SSE)事件分发
+"""
+
+import json
+import queue
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from db import SystemMessage, db_writer
+
+
+class EventBroker:
+    """
+    一个生产者，多个订阅者的事件分发器
+
+    调度任务产生数据后调用 notify/publish，每个事件只序列化一次，
+    再分发到所有订阅者的队列中，浏览器标签页数量不会增加数据库查询。
+
+    同时为每个主题维护一个版本号，数据每变化一次加1，用作接口的ETag。
+
+    每个SSE连接会一直占用一个web工作线程，订阅者数量超过 max_subscribers 时
+    拒绝新的连接，页面改为使用ETag轮询，避免推送连接占满工作线程。
+    """
+
+    # 单个订阅者的队列上限，消费过慢时丢弃新事件
+    QUEUE_SIZE = 100
+    # 心跳间隔，单位秒，避免连接被代理断开
+    HEARTBEAT_INTERVAL = 15
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[Tuple[queue.Queue, Set[str]]] = []
+        # topic -> 生成当前完整数据的函数
+        self._builders: Dict[str, Callable[[], Any]] = {}
+        # topic -> 版本号，加上进程启动时生成的随机前缀，重启后旧的ETag全部失效
+        self._versions: Dict[str, int] = {}
+        self._nonce = uuid.uuid4().hex[:8]
+        # 同时存在的订阅者上限，None表示不限制
+        self.max_subscribers: Optional[int] = None
+
+    def register(self, topic: str, builder: Callable[[], Any]):
+        """
+        注册某个主题的数据生成函数，用于 notify 以及新订阅者的初始数据
+        """
+        self._builders[topic] = builder
+
+    def bump(self, topic: str):
+        """
+        标记主题数据已变化，不推送
+        """
+        with self._lock:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+
+    def etag(self, topic: str) -> str:
+        with self._lock:
+            return f"{topic}-{self._nonce}-{self._versions.get(topic, 0)}"
+
+    def notify(self, topic: str):
+        """
+        主题数据已变化，有订阅者时重新生成一次并推送
+        """
+        self.bump(topic)
+        builder = self._builders.get(topic)
+        if builder is None or not self._has_subscribers(topic):
+            return
+        self.publish(topic, builder())
+
+    def publish(self, topic: str, data: Any):
+        self.bump(topic)
+        if not self._has_subscribers(topic):
+            return
+        message = self._format(topic, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber_queue, topics in subscribers:
+            if topic not in topics:
+                continue
+            try:
+                subscriber_queue.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def open_stream(self, topics: Iterable[str]) -> Optional["EventStream"]:
+        """
+        订阅主题并返回SSE响应体，订阅者已达上限时返回None
+        """
+        topics = set(topics)
+        subscriber_queue: queue.Queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            if (
+                self.max_subscribers is not None
+                and len(self._subscribers) >= self.max_subscribers
+            ):
+                return None
+            self._subscribers.append((subscriber_queue, topics))
+        return EventStream(self, subscriber_queue, topics)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _unsubscribe(self, subscriber_queue: queue.Queue):
+        with self._lock:
+            self._subscribers = [
+                i for i in self._subscribers if i[0] is not subscriber_queue
+            ]
+
+    def _has_subscribers(self, topic: str) -> bool:
+        with self._lock:
+            return any(topic in topics for _, topics in self._subscribers)
+
+    @staticmethod
+    def _format(topic: str, data: Any) -> str:
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False, default=str)
+        return f"event: {topic}\ndata: {data}\n\n"
+
+
+class EventStream:
+    """
+    一个订阅者的SSE响应体，先发送各主题的当前数据，之后持续推送变化
+
+    订阅在创建时就已生效，响应结束或客户端断开时由WSGI服务器调用 close 取消订阅，
+    即使响应体一次也没有被迭代过
+    """
+
+    def __init__(
+        self, broker: EventBroker, subscriber_queue: queue.Queue, topics: Set[str]
+    ):
+        self._broker = broker
+        self._queue = subscriber_queue
+        self._events = self._generate(topics)
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        return next(self._events)
+
+    def close(self):
+        self._events.close()
+        self._broker._unsubscribe(self._queue)
+
+    def _generate(self, topics: Set[str]) -> Iterator[str]:
+        for topic in topics:
+            builder = self._broker._builders.get(topic)
+            if builder is not None:
+                yield self._broker._format(topic, builder())
+        while True:
+            try:
+                yield self._queue.get(timeout=self._broker.HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": ping\n\n"
+
+
+event_broker = EventBroker()
+
+
+def _publish_new_logs(rows):
+    logs = [
+        {
+            "time": row["created_time"].strftime("%Y-%m-%d %H:%M:%S"),
+            "type": row.get("message_type"),
+            "category": row.get("category"),
+            "content": row.get("content"),
+        }
+        for model, row in rows
+        if model is SystemMessage
+    ]
+    if logs:
+        event_broker.publish("logs", logs)
+
+
+db_writer.subscribe(_publish_new_logs)
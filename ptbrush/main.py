@@ -13,7 +13,7 @@ from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
 from loguru import logger
 import tasks as tasks
-from config.config import BrushConfig, PTBrushConfig
+from config.config import BrushConfig, PTBrushConfig, config_provider, get_config
 from web.server import start_web_server_thread
 import os
 from db import migrate_database, db_log_sink
@@ -42,13 +42,61 @@ def run_if_work_time(func):
     """只在工作时间内运行的装饰器"""
 
     def wrapper():
-        config = PTBrushConfig()
+        config = get_config()
         if check_work_time(config.brush):
             func()
 
     return wrapper
 
 
+# 执行间隔可配置的任务: (任务id, 任务, 从配置中读取执行间隔(秒))
+INTERVAL_JOBS = [
+    # 刷流任务，受刷流任务工作时间设置
+    ("brush", run_if_work_time(tasks.brush), lambda c: c.brush.brush_interval * 60),
+    # 记录QB状态
+    ("fetch_qb_status", tasks.fetch_qb_status, lambda c: c.brush.qb_status_interval),
+    # 记录QB中的种子状态
+    (
+        "fetch_qb_torrents",
+        tasks.fetch_qb_torrents,
+        lambda c: c.brush.qb_torrents_interval,
+    ),
+    # 抓取PT站的种子
+    (
+        "fetch_pt_torrents",
+        tasks.fetch_pt_torrents,
+        lambda c: c.brush.pt_fetch_interval * 60,
+    ),
+    # 清理长时间无活跃的种子
+    (
+        "clean_long_time_no_activate_torrents",
+        tasks.clean_long_time_no_activate_torrents,
+        lambda c: c.brush.clean_interval * 60,
+    ),
+    # 检查磁盘空间并清理
+    (
+        "check_disk_space_and_cleanup",
+        tasks.check_disk_space_and_cleanup,
+        lambda c: c.brush.disk_check_interval * 60,
+    ),
+]
+
+
+def add_interval_jobs(scheduler, config: PTBrushConfig):
+    for job_id, task, interval in INTERVAL_JOBS:
+        scheduler.add_job(task, "interval", seconds=interval(config), id=job_id)
+
+
+def reschedule_interval_jobs(scheduler, old: PTBrushConfig, new: PTBrushConfig):
+    """配置变化后，只重新调度执行间隔有变化的任务"""
+    for job_id, _, interval in INTERVAL_JOBS:
+        old_seconds, new_seconds = interval(old), interval(new)
+        if old_seconds == new_seconds:
+            continue
+        scheduler.reschedule_job(job_id, trigger="interval", seconds=new_seconds)
+        logger.info(f"任务 {job_id} 的执行间隔已从 {old_seconds} 秒调整为 {new_seconds} 秒")
+
+
 def main():
     # 初始化配置文件
     PTBrushConfig.init_config()
@@ -65,29 +113,22 @@ def main():
     job_defaults = {"coalesce": True, "max_instances": 1}
     scheduler = BlockingScheduler(executors=executors, job_defaults=job_defaults)
 
-    # 每10分钟执行一次刷流任务，受刷流任务工作时间设置
-    scheduler.add_job(run_if_work_time(tasks.brush), "cron", minute="*/10")
+    # 执行间隔可配置的任务，配置文件修改后自动重新调度
+    add_interval_jobs(scheduler, get_config())
+    config_provider.add_listener(
+        lambda old, new: reschedule_interval_jobs(scheduler, old, new)
+    )
+    # 定期检查配置文件是否修改，保存配置接口之外直接编辑文件也能生效
+    scheduler.add_job(get_config, "interval", seconds=10, id="config_watch")
 
     # 每10分钟检查一次即将过期的种子
     scheduler.add_job(tasks.clean_will_expire_torrents, "cron", minute="*/10")
 
-    # 每15秒记录一次QB状态
-    scheduler.add_job(tasks.fetch_qb_status, "cron", second="*/15")
-
-    # 每分钟记录一次QB中的种子状态
-    scheduler.add_job(tasks.fetch_qb_torrents, "cron", minute="*")
-
-    # 每15分钟抓取一次PT站的种子
-    config = PTBrushConfig()
-    scheduler.add_job(
-        tasks.fetch_pt_torrents, "cron", minute=f"*/{config.brush.pt_fetch_interval}"
-    )
-
-    # 每3分钟清理一次长时间无活跃的种子
-    scheduler.add_job(tasks.clean_long_time_no_activate_torrents, "cron", minute="*/3")
+    # 每分钟把新的QB状态以及种子状态采样聚合到时序数据桶中
+    scheduler.add_job(tasks.rollup_time_series, "cron", minute="*")
 
-    # 每5分钟检查一次磁盘空间并清理
-    scheduler.add_job(tasks.check_disk_space_and_cleanup, "cron", minute="*/5")
+    # 每小时清理一次过期的原始采样以及聚合桶
+    scheduler.add_job(tasks.prune_time_series, "cron", hour="*")
 
     # 每小时清理一次过期的系统日志（只保留24小时）
     scheduler.add_job(tasks.clean_db_logs, "cron", hour="*")
@@ -105,6 +146,7 @@ def main():
         ("同步QB状态", tasks.fetch_qb_status),
         ("同步QB种子", tasks.fetch_qb_torrents),
         ("清理过期日志", tasks.clean_db_logs),
+        ("聚合时序数据", tasks.rollup_time_series),
         ("抓取PT新种", tasks.fetch_pt_torrents),
         ("执行刷流", run_if_work_time(tasks.brush)),
         ("清理过期种子", tasks.clean_will_expire_torrents),
@@ -9,6 +9,7 @@
 from datetime import datetime
 from math import sqrt
 import math
+from typing import List, Optional
 from pydantic import BaseModel, computed_field
 
 
@@ -29,4 +30,34 @@ class Torrent(BaseModel):
         if self.seeders == 0 or self.leechers == 0 or self.size == 0:
             return 0
         return int((self.leechers/sqrt(self.seeders + 1)) * (math.log(self.size//1024//1024)) * math.log(self.seeders + 1))
-        
\ No newline at end of file
+
+
+class Watermark(BaseModel):
+    """
+    某个分类已经抓取到的最新种子，增量抓取时遇到它或更早的种子即停止
+    """
+    torrent_id: int
+    created_time: datetime
+
+
+class SearchPage(BaseModel):
+    """
+    一个分类的一次搜索结果
+    """
+    category: str
+    torrents: List[Torrent] = []
+    # 本次搜索看到的最新种子，没有新种子时为空
+    watermark: Optional[Watermark] = None
+    # 是否全量搜索，False为增量搜索
+    full: bool = True
+    # 请求的页数
+    pages: int = 0
+    # 扫描过的种子数，以及其中可以作为刷流候选的种子数
+    items: int = 0
+    candidates: int = 0
+    # 搜索请求失败
+    failed: bool = False
+    # 是否完整：增量搜索一直翻到了水位或最后一页；全量搜索没有中途失败。
+    # 增量搜索因候选占比低、达到页数上限或中途失败而提前停止时，
+    # 本次最新种子与旧水位之间可能还有没扫描到的种子
+    complete: bool = True
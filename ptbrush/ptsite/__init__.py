@@ -7,17 +7,192 @@
 @Desc    :   None
 """
 import abc
-from typing import Any, Generator, List, Optional
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+from time import sleep
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Set, Tuple
 
 import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
 
-from config.config import HeaderParam
-from model import Torrent
+from config.config import HeaderParam, SiteModel
+from model import SearchPage, Torrent, Watermark
+
+
+class SiteSessionPool:
+    """
+    每个站点共享一个 requests.Session
+
+    爬虫对象每次任务都会重新创建，连接池放在这里才能在多次搜索、获取下载链接、
+    下载种子之间复用 keep-alive 连接，避免每个请求都重新建立TCP和TLS连接。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: 站点 value: (连接池大小, session)
+        self._sessions: Dict[str, Tuple[int, requests.Session]] = {}
+
+    def get(self, site: str, pool_size: int) -> requests.Session:
+        """
+        获取站点的session，配置中的连接池大小变化时替换为新的session并关闭旧的
+        """
+        entry = self._sessions.get(site)
+        if entry is not None and entry[0] == pool_size:
+            return entry[1]
+        with self._lock:
+            entry = self._sessions.get(site)
+            if entry is not None and entry[0] == pool_size:
+                return entry[1]
+            session = requests.Session()
+            # 重试由 BaseSiteSpider.fetch 控制，这里不让urllib3自己重试
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._sessions[site] = (pool_size, session)
+        if entry is not None:
+            entry[1].close()
+        return session
+
+
+site_session_pool = SiteSessionPool()
+
+
+class TokenBucket:
+    """
+    令牌桶限速器
+
+    每秒补充 rate 个令牌，最多积累 burst 个，每个请求消耗一个令牌，没有令牌时等待。
+    站点返回429/Retry-After时调用 pause，在此之前所有请求都会等待，之后只放行一个请求。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = sleep,
+    ):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._sleep = sleep
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = clock()
+
+    def configure(self, rate: float, burst: int):
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(self._tokens, burst)
+
+    def acquire(self) -> float:
+        """
+        取得一个令牌，返回等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if self._last <= now and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                # 暂停期间 _last 在未来，先等到暂停结束
+                wait = max(self._last - now, 0) + max(1 - self._tokens, 0) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """
+        暂停发放令牌，用于服务端要求的 Retry-After
+        """
+        with self._lock:
+            until = self._clock() + seconds
+            if until > self._last:
+                self._last = until
+                self._tokens = 1
+
+    def _refill(self, now: float):
+        if now > self._last:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+
+class SiteRateLimiters:
+    """
+    每个站点一个令牌桶，搜索、获取下载链接、下载种子共用
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def get(self, site: str, rate_per_minute: float, burst: int) -> TokenBucket:
+        rate = rate_per_minute / 60
+        with self._lock:
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                bucket = self._buckets[site] = TokenBucket(rate, burst)
+        if bucket.rate != rate or bucket.burst != burst:
+            bucket.configure(rate, burst)
+        return bucket
+
+
+site_rate_limiters = SiteRateLimiters()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After 可以是秒数，也可以是HTTP日期
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
 
 
 class BaseSiteSpider:
+    NAME = ""
 
-    def __init__(self, cookie: str, headers: List[HeaderParam] = []):
+    # 可以重试的网络错误，其余异常(如URL错误)重试也不会成功，直接抛出
+    RETRYABLE_EXCEPTIONS = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+    # 可以重试的响应状态码
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+    # 429且没有Retry-After时暂停的秒数
+    DEFAULT_RETRY_AFTER = 60
+
+    def __init__(
+        self,
+        cookie: str,
+        headers: List[HeaderParam] = [],
+        pool_size: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        rate_limit: float = 6,
+        rate_burst: int = 3,
+        search_concurrency: int = 3,
+        max_search_pages: int = 3,
+        min_page_yield: float = 0.3,
+        candidate_min_score: int = 1,
+    ):
         self.cookie = cookie
         # self.headers = headers
         self.headers = {
@@ -26,11 +201,27 @@ class BaseSiteSpider:
         }
         for i in headers:
             self.headers[i.key] = i.value
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.session = site_session_pool.get(self.NAME, pool_size)
+        self.rate_limiter = site_rate_limiters.get(self.NAME, rate_limit, rate_burst)
+        self.search_concurrency = search_concurrency
+        self.max_search_pages = max_search_pages
+        self.min_page_yield = min_page_yield
+        self.candidate_min_score = candidate_min_score
 
     def fetch(self, url: str, method: str = "GET", data: Any = "", *args, **kwargs) -> requests.Response:
-        for i in range(3):
+        """
+        使用站点共享的连接池发送请求
+
+        每次请求(包括重试)前先从站点的令牌桶取得令牌。
+        网络错误以及5xx响应按指数退避重试，429按Retry-After暂停整个站点后重试，
+        最后一次仍失败时返回该响应
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
             try:
-                response = requests.request(
+                response = self.session.request(
                     method,
                     url,
                     headers=self.headers,
@@ -40,15 +231,58 @@ class BaseSiteSpider:
                     *args,
                     **kwargs
                 )
-                return response
-            except:
-                pass
-        raise Exception("fetch failed")
+            except self.RETRYABLE_EXCEPTIONS as e:
+                if attempt >= self.max_retries:
+                    raise Exception(f"fetch failed: {e}") from e
+                reason = str(e)
+            else:
+                if (
+                    response.status_code not in self.RETRYABLE_STATUS
+                    or attempt >= self.max_retries
+                ):
+                    return response
+                reason = f"HTTP {response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                # 要重试的响应不再读取，立即释放连接
+                response.close()
+                if response.status_code == 429 and retry_after is None:
+                    retry_after = self.DEFAULT_RETRY_AFTER
+                if retry_after is not None:
+                    # 由令牌桶等待，同一站点的其他请求也会一起暂停
+                    logger.warning(
+                        f"{self.NAME} 请求过于频繁({reason})，暂停{retry_after:.0f}秒: {url}"
+                    )
+                    self.rate_limiter.pause(retry_after)
+                    continue
+
+            delay = self.retry_backoff * (2**attempt) * random.uniform(1, 1.5)
+            logger.warning(
+                f"{self.NAME} 请求失败({reason})，{delay:.1f}秒后第{attempt + 1}次重试: {url}"
+            )
+            sleep(delay)
 
     @abc.abstractmethod
     def free_torrents(self):
         pass
 
+    # 刷流候选至少要剩余的free时间，与 BrushService.get_brush_torrent 一致
+    CANDIDATE_MIN_FREE_TIME = timedelta(hours=3)
+
+    # 站点的搜索分类，以及其中按创建时间倒序、支持增量抓取的分类
+    CATEGORIES: List[str] = ["all"]
+    INCREMENTAL_CATEGORIES: Set[str] = set()
+
+    def free_torrent_pages(
+        self,
+        categories: Optional[Iterable[str]] = None,
+        watermarks: Optional[Dict[str, Watermark]] = None,
+    ) -> Generator[SearchPage, None, None]:
+        """
+        按分类返回搜索结果，便于调用方每拿到一个分类就入库
+        默认把全部结果作为一个分类全量搜索，支持并发或增量搜索的站点应覆盖此方法
+        """
+        yield SearchPage(category="all", torrents=list(self.free_torrents()), pages=1)
+
     @abc.abstractmethod
     def parse_torrent_link(self, torrent_id: str) -> str:
         pass
@@ -62,7 +296,7 @@ class TorrentFetch:
 
     SITE_SPIDER_MAP = {"M-Team": MTeamSpider}
 
-    def __init__(self, site: str, cookie: str, headers: List[HeaderParam] = []):
+    def __init__(self, site: str, cookie: str, headers: List[HeaderParam] = [], **options):
         self.site = site
         self.cookie = cookie
         self.headers = headers
@@ -71,7 +305,24 @@ class TorrentFetch:
             raise ValueError(f"Unknown site: {self.site}")
 
         self._spider_class: BaseSiteSpider = spider_class(
-            self.cookie, self.headers)
+            self.cookie, self.headers, **options)
+
+    @classmethod
+    def from_config(cls, site: SiteModel) -> "TorrentFetch":
+        return cls(
+            site.name,
+            site.cookie,
+            site.headers,
+            pool_size=site.pool_size,
+            max_retries=site.max_retries,
+            retry_backoff=site.retry_backoff,
+            rate_limit=site.rate_limit,
+            rate_burst=site.rate_burst,
+            search_concurrency=site.search_concurrency,
+            max_search_pages=site.max_search_pages,
+            min_page_yield=site.min_page_yield,
+            candidate_min_score=site.candidate_min_score,
+        )
 
     @property
     def free_torrents(self) -> Generator[Torrent, Torrent, Torrent]:
@@ -79,6 +330,21 @@ class TorrentFetch:
         for torrent in self._spider_class.free_torrents():
             yield torrent
 
+    @property
+    def categories(self) -> List[str]:
+        return self._spider_class.CATEGORIES
+
+    @property
+    def incremental_categories(self) -> Set[str]:
+        return self._spider_class.INCREMENTAL_CATEGORIES
+
+    def free_torrent_pages(
+        self,
+        categories: Optional[Iterable[str]] = None,
+        watermarks: Optional[Dict[str, Watermark]] = None,
+    ) -> Generator[SearchPage, None, None]:
+        return self._spider_class.free_torrent_pages(categories, watermarks)
+
     def parse_torrent_link(self, torrent_id: str) -> str:
         return self._spider_class.parse_torrent_link(torrent_id)
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   extract.py
+@Time    :   2026/10/18 13:20:05
+@Version :   1.0
+@Desc    :   站点接口返回数据的字段提取
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+
+class FieldPath:
+    """
+    编译后的点分路径，如 "status.mallSingleFree.status"，兼容 "$." 前缀
+
+    路径在创建时拆分好，提取时只是逐层取dict的值，路径中任意一层不存在
+    或不是dict时返回None
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path.startswith("$."):
+            path = path[2:]
+        self._keys: Tuple[str, ...] = tuple(path.split("."))
+
+    def __call__(self, item: Any) -> Any:
+        for key in self._keys:
+            if not isinstance(item, dict):
+                return None
+            item = item.get(key)
+        return item
+
+    def __repr__(self) -> str:
+        return f"FieldPath({self.path!r})"
+
+
+class Field:
+    """
+    一个字段的声明
+
+    可以给出多个路径，按顺序取第一个非空的值；convert 在取到值后调用，
+    取不到值时返回 default
+    """
+
+    def __init__(
+        self,
+        *paths: str,
+        convert: Optional[Callable[[Any], Any]] = None,
+        default: Any = None,
+    ):
+        if not paths:
+            raise ValueError("Field requires at least one path")
+        self.paths = tuple(FieldPath(p) for p in paths)
+        self.convert = convert
+        self.default = default
+
+    def __call__(self, item: Any) -> Any:
+        for path in self.paths:
+            value = path(item)
+            if value is not None and value != "":
+                return self.convert(value) if self.convert else value
+        return self.default
+
+
+class Extractor:
+    """
+    由声明式的字段表生成的提取器，在类定义时创建一次，对每条数据只做dict取值
+
+    >>> extract = Extractor(name="name", seeders=Field("status.seeders", convert=int))
+    >>> extract({"name": "a", "status": {"seeders": "3"}})
+    {'name': 'a', 'seeders': 3}
+    """
+
+    def __init__(self, **fields: Union[str, Field]):
+        self.fields: Dict[str, Field] = {
+            name: spec if isinstance(spec, Field) else Field(spec)
+            for name, spec in fields.items()
+        }
+
+    def __call__(self, item: Any) -> Dict[str, Any]:
+        return {name: field(item) for name, field in self.fields.items()}
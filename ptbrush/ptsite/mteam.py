@@ -7,15 +7,19 @@
 @Desc    :   None
 """
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import json
-from time import sleep
-from typing import Generator, Optional
+from typing import Dict, Generator, Iterable, List, Optional
 
 from loguru import logger
-from model import Torrent
+from model import SearchPage, Torrent, Watermark
 from ptsite import BaseSiteSpider
-from jsonpath_ng import parse
+from ptsite.extract import Extractor, Field
+
+
+def parse_datetime(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
 
 
 class MTeamSpider(BaseSiteSpider):
@@ -24,6 +28,26 @@ class MTeamSpider(BaseSiteSpider):
     API = "api/torrent/search"
     TORRENT_API = "api/torrent/genDlToken"
     PAGE_SIZE = 200
+    # 搜索结果解析失败时暂停请求的秒数
+    ERROR_PAUSE = 60
+
+    # 搜索结果中每个种子需要的字段
+    FIELDS = Extractor(
+        id=Field("id", convert=int),
+        name="name",
+        size=Field("size", convert=int),
+        created_time=Field("createdDate", convert=parse_datetime),
+        seeders="status.seeders",
+        leechers="status.leechers",
+        discount="status.discount",
+        mall_single_free_status="status.mallSingleFree.status",
+        # 优先使用促销结束时间，其次是单种免费的结束时间
+        free_end_time=Field(
+            "status.discountEndTime",
+            "status.mallSingleFree.endDate",
+            convert=parse_datetime,
+        ),
+    )
     BODYS = [
         # 电影最新
         {
@@ -81,84 +105,207 @@ class MTeamSpider(BaseSiteSpider):
         },
     ]
 
+    # 所有分类，以及按创建时间倒序、可以增量抓取的分类
+    CATEGORIES = [body["mode"] for body in BODYS]
+    INCREMENTAL_CATEGORIES = {
+        body["mode"] for body in BODYS if body["sortField"] == "CREATED_DATE"
+    }
+    # 增量抓取时每页的种子数，页数上限与全量搜索一样由 max_search_pages 决定
+    INCREMENTAL_PAGE_SIZE = 50
+
     def free_torrents(self) -> Generator[Torrent, Torrent, Torrent]:
-        for body in self.BODYS:
-            logger.info(
-                f"searching mt body:{json.dumps(body, separators=(',', ':'), ensure_ascii=False)}"
+        for page in self.free_torrent_pages():
+            yield from page.torrents
+
+    def free_torrent_pages(
+        self,
+        categories: Optional[Iterable[str]] = None,
+        watermarks: Optional[Dict[str, Watermark]] = None,
+    ) -> Generator[SearchPage, None, None]:
+        """
+        并发搜索各个分类，哪个先返回就先交给调用方入库
+
+        categories 为要搜索的分类，默认全部；watermarks 中有水位的分类只增量抓取
+        比水位更新的种子，其余分类全量搜索。
+        并发数由站点配置的 search_concurrency 决定，请求速度仍受站点令牌桶限制
+        """
+        watermarks = watermarks or {}
+        bodies = [
+            body
+            for body in self.BODYS
+            if categories is None or body["mode"] in categories
+        ]
+        if not bodies:
+            return
+        with ThreadPoolExecutor(
+            max_workers=min(self.search_concurrency, len(bodies)),
+            thread_name_prefix="mt-search",
+        ) as executor:
+            futures = {
+                executor.submit(
+                    self._search_category, body, watermarks.get(body["mode"])
+                ): body
+                for body in bodies
+            }
+            for future in as_completed(futures):
+                category = futures[future]["mode"]
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.error(f"mt search failed: mode={category}, {e}")
+                    yield SearchPage(category=category, failed=True)
+
+    def _search_category(self, body: dict, watermark: Optional[Watermark]) -> SearchPage:
+        """
+        按时间倒序的分类自适应翻页：一页中刷流候选的占比低于 min_page_yield、
+        页不满、或增量抓取遇到水位时停止，最多 max_search_pages 页。
+        其他分类(如排行榜)只看第一页
+
+        只有遇到水位或页不满而停止的增量搜索是完整的，其余情况返回 complete=False
+        """
+        category = body["mode"]
+        if category not in self.INCREMENTAL_CATEGORIES:
+            items = self._search(body)
+            return self._to_page(category, items, full=True, pages=1)
+
+        incremental = watermark is not None
+        page_size = self.INCREMENTAL_PAGE_SIZE if incremental else body["pageSize"]
+        collected = []
+        pages = 0
+        complete = not incremental
+        for page_number in range(1, self.max_search_pages + 1):
+            items = self._search(
+                {**body, "pageNumber": page_number, "pageSize": page_size}
             )
-            text = self.fetch(
-                url=f"https://{self.HOST}/{self.API}",
-                method="POST",
-                data=json.dumps(body),
-            ).text
+            pages += 1
+            if items is None:
+                if not collected:
+                    return SearchPage(
+                        category=category, full=not incremental, pages=pages, failed=True
+                    )
+                complete = False
+                break
+
+            new_items = []
+            reached = False
+            for fields in items:
+                if incremental and self._is_known(fields, watermark):
+                    reached = True
+                    break
+                new_items.append(fields)
+            collected.extend(new_items)
+
+            if reached or len(items) < page_size:
+                complete = True
+                break
+            candidates = sum(1 for fields in new_items if self._is_candidate(fields))
+            if candidates / len(items) < self.min_page_yield:
+                break
+        return self._to_page(
+            category, collected, full=not incremental, pages=pages, complete=complete
+        )
+
+    def _search(self, body: dict) -> Optional[List[dict]]:
+        """
+        搜索一页，返回提取好字段的种子列表，请求结果无法解析时返回None
+        """
+        logger.info(
+            f"searching mt body:{json.dumps(body, separators=(',', ':'), ensure_ascii=False)}"
+        )
+        text = self.fetch(
+            url=f"https://{self.HOST}/{self.API}",
+            method="POST",
+            data=json.dumps(body),
+        ).text
+        try:
+            data = json.loads(text).get("data", {}).get("data")
+        except:
+            # 多半是请求太快被限制了，暂停整个站点的请求
+            logger.error(f"mt search error:{text}, will pause {self.ERROR_PAUSE}s")
+            self.rate_limiter.pause(self.ERROR_PAUSE)
+            return None
+        items = []
+        for item in data or []:
             try:
-                data = json.loads(text).get("data", {}).get("data")
-            except:
-                logger.error(f"mt search error:{text}, will sleep 60s")
-                sleep(60)
-                continue
-            if data:
-                for item in data:
-                    # free种子，且有free结束时间
-                    if self._is_free_torrent(item) and self._parse_free_end_time(item):
-                        yield self._parse_torrent(item)
-
-            # 睡会，别请求太快
-            sleep(60)
-
-    def _get_jsonpath_values(self, item, expr):
+                items.append(self.FIELDS(item))
+            except ValueError as e:
+                logger.warning(f"mt torrent parse error: id={item.get('id')}, {e}")
+        return items
+
+    def _to_page(
+        self,
+        category: str,
+        items: Optional[List[dict]],
+        full: bool,
+        pages: int,
+        complete: bool = True,
+    ) -> SearchPage:
+        if items is None:
+            return SearchPage(category=category, full=full, pages=pages, failed=True)
+        watermark = None
+        dated = [fields for fields in items if fields["created_time"]]
+        if dated:
+            newest = max(dated, key=lambda fields: fields["created_time"])
+            watermark = Watermark(
+                torrent_id=newest["id"], created_time=newest["created_time"]
+            )
+        return SearchPage(
+            category=category,
+            # free种子，且有free结束时间
+            torrents=[
+                self._parse_torrent(fields)
+                for fields in items
+                if self._is_free_torrent(fields) and fields["free_end_time"]
+            ],
+            watermark=watermark,
+            full=full,
+            pages=pages,
+            complete=complete,
+            items=len(items),
+            candidates=sum(1 for fields in items if self._is_candidate(fields)),
+        )
+
+    def _is_candidate(self, fields: dict) -> bool:
+        """
+        是否可以作为刷流候选：free且剩余free时间足够，评分不低于 candidate_min_score
+        """
+        if not self._is_free_torrent(fields) or not fields["free_end_time"]:
+            return False
+        if fields["free_end_time"] - datetime.now() < self.CANDIDATE_MIN_FREE_TIME:
+            return False
         try:
-            jsonpath_expr = parse(expr)
-            return [match.value for match in jsonpath_expr.find(item)]
-        except Exception:
-            return []
+            return self._parse_torrent(fields).score >= self.candidate_min_score
+        except ValueError:
+            # 评分计算对过小的种子会出错
+            return False
 
-    def _is_free_torrent(self, item: dict) -> bool:
+    @staticmethod
+    def _is_known(fields: dict, watermark: Watermark) -> bool:
+        if fields["id"] == watermark.torrent_id:
+            return True
+        return fields["created_time"] is not None and fields["created_time"] < watermark.created_time
+
+    def _is_free_torrent(self, fields: dict) -> bool:
         """
         满足以下任意即为free,规则如下：
         1. discount = FREE or _2X_FREE
         2. mallSingleFree.status = ONGOING
         """
-        discounts = self._get_jsonpath_values(item, "$.status.discount")
-
-        mall_single_free_statuss = self._get_jsonpath_values(
-            item, "$.status.mallSingleFree.status"
-        )
-
-        if discounts and discounts[0] in ["FREE", "_2X_FREE"]:
+        if fields["discount"] in ["FREE", "_2X_FREE"]:
             return True
-        if mall_single_free_statuss and mall_single_free_statuss[0] == "ONGOING":
+        if fields["mall_single_free_status"] == "ONGOING":
             return True
         return False
 
-    def _parse_free_end_time(self, item: dict) -> Optional[str]:
-        discount_end_times_1 = self._get_jsonpath_values(
-            item, "$.status.discountEndTime"
-        )
-        if discount_end_times_1 and discount_end_times_1[0]:
-            return discount_end_times_1[0]
-        discount_end_times_2 = self._get_jsonpath_values(
-            item, "$.status.mallSingleFree.endDate"
-        )
-        if discount_end_times_2 and discount_end_times_2[0]:
-            return discount_end_times_2[0]
-        return None
-
-    def _parse_torrent(self, item: dict) -> Torrent:
-        free_end_time_str = self._parse_free_end_time(item)
-
-        free_end_time = datetime.strptime(free_end_time_str, "%Y-%m-%d %H:%M:%S")
-
+    def _parse_torrent(self, fields: dict) -> Torrent:
         torrent = Torrent(
-            name=item.get("name"),
-            id=item.get("id"),
-            seeders=item.get("status").get("seeders"),
-            leechers=item.get("status").get("leechers"),
-            size=int(item.get("size")),
-            created_time=datetime.strptime(
-                item.get("createdDate"), "%Y-%m-%d %H:%M:%S"
-            ),
-            free_end_time=free_end_time,
+            name=fields["name"],
+            id=fields["id"],
+            seeders=fields["seeders"],
+            leechers=fields["leechers"],
+            size=fields["size"],
+            created_time=fields["created_time"],
+            free_end_time=fields["free_end_time"],
             site=self.NAME,
         )
 
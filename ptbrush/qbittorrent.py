@@ -8,10 +8,13 @@
 """
 
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 import re
+import threading
+import time
 import traceback
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 import uuid
 import qbittorrentapi
 import requests
@@ -42,59 +45,243 @@ class QBittorrentStatus(BaseModel):
     free_space_size: int
 
 
+class QBClientPool:
+    """
+    进程内共享的qb客户端，同一个下载器只登录一次
+
+    客户端底层的 requests.Session 保持长连接，登录失效(403)时由 qbittorrentapi 自动重新登录
+    """
+
+    # 每个下载器的HTTP连接池大小，需覆盖调度线程数以及web线程
+    POOL_SIZE = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str, str], qbittorrentapi.Client] = {}
+
+    def get(
+        self,
+        qb_url: str,
+        username: str,
+        password: str,
+        setup: Optional[Callable[[qbittorrentapi.Client], None]] = None,
+    ) -> qbittorrentapi.Client:
+        """
+        获取共享客户端，首次创建时登录并执行一次 setup
+        """
+        key = (qb_url, username, password)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+
+            client = qbittorrentapi.Client(
+                host=qb_url,
+                username=username,
+                password=password,
+                HTTPADAPTER_ARGS={
+                    "pool_connections": self.POOL_SIZE,
+                    "pool_maxsize": self.POOL_SIZE,
+                },
+            )
+            client.auth_log_in()
+            if setup:
+                setup(client)
+            self._clients[key] = client
+            logger.info(f"已登录qb下载器: {qb_url}")
+            return client
+
+
+qb_client_pool = QBClientPool()
+
+
+class TorrentSnapshotCache:
+    """
+    进程内共享的种子列表快照，同一个调度周期内的多个任务复用同一份列表，
+    避免每次访问都完整拉取一次 torrents_info
+    """
+
+    # 快照有效期，单位秒
+    TTL = 20
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: (qb_url, category) value: (生成时间, 种子列表)
+        self._snapshots: Dict[Tuple[str, str], Tuple[float, List[QBitorrentTorrent]]] = {}
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[QBitorrentTorrent]]:
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if not snapshot:
+            return None
+        created, torrents = snapshot
+        if time.monotonic() - created > self.TTL:
+            return None
+        return list(torrents)
+
+    def put(self, key: Tuple[str, str], torrents: List[QBitorrentTorrent]):
+        with self._lock:
+            self._snapshots[key] = (time.monotonic(), list(torrents))
+
+    def invalidate(self, key: Optional[Tuple[str, str]] = None):
+        """
+        添加或删除种子后调用，使下一次访问重新拉取
+        """
+        with self._lock:
+            if key is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(key, None)
+
+
+torrent_snapshot_cache = TorrentSnapshotCache()
+
+
+class QBSyncEngine:
+    """
+    基于 sync/maindata 的增量同步引擎
+
+    在内存中维护一份完整的种子表和服务器状态，每次只向qb请求上一次rid之后的变化，
+    qb返回 full_update 时（首次请求或会话变化）整表重建。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rid = 0
+        self._torrents: Dict[str, dict] = {}
+        self._server_state: dict = {}
+
+    def sync(self, client: qbittorrentapi.Client):
+        with self._lock:
+            try:
+                data = client.sync_maindata(rid=self.rid)
+            except Exception:
+                # 请求失败时无法确认服务端记录的rid，下次重新全量同步
+                self.rid = 0
+                raise
+            if data.get("full_update"):
+                self._torrents = {}
+                self._server_state = {}
+
+            for torrent_hash, fields in (data.get("torrents") or {}).items():
+                torrent = self._torrents.setdefault(torrent_hash, {"hash": torrent_hash})
+                torrent.update(dict(fields))
+            for torrent_hash in data.get("torrents_removed") or []:
+                self._torrents.pop(torrent_hash, None)
+
+            self._server_state.update(dict(data.get("server_state") or {}))
+            self.rid = data.get("rid", 0)
+
+    @property
+    def server_state(self) -> dict:
+        with self._lock:
+            return dict(self._server_state)
+
+    def torrents(self, category: str) -> List[dict]:
+        with self._lock:
+            return [
+                dict(i) for i in self._torrents.values() if i.get("category") == category
+            ]
+
+
+_sync_engines_lock = threading.Lock()
+_sync_engines: Dict[str, QBSyncEngine] = {}
+
+
+def get_sync_engine(qb_url: str) -> QBSyncEngine:
+    with _sync_engines_lock:
+        engine = _sync_engines.get(qb_url)
+        if engine is None:
+            engine = _sync_engines[qb_url] = QBSyncEngine()
+        return engine
+
+
+@lru_cache(maxsize=4096)
+def _parse_meta_name(
+    full_name: str,
+) -> Tuple[str, str, str, Optional[datetime]]:
+    """
+    解析添加种子时写入名称中的元信息，返回(名称, 站点, 种子ID, free结束时间)
+    """
+    match = re.search(r"__meta\.(.*?)\.(\d+)\.endTime\.([\d\-:]+)", full_name)
+    if not match:
+        return full_name, "", "", None
+
+    site, torrent_id, end_time_str = match.groups()
+    name = full_name[: match.start()]
+    try:
+        end_time = datetime.strptime(end_time_str, "%Y-%m-%d-%H:%M:%S")
+    except ValueError as e:
+        logger.error(f"Parse time error: {full_name} - {e}")
+        end_time = None
+    return name, site, torrent_id, end_time
+
+
 class QBittorrent:
     def close(self):
-        self.qb.auth_log_out()
+        """
+        客户端由进程内共享，其他任务可能正在使用，这里不登出，只释放本对象的引用
+        """
+        self.qb = None
 
     def __init__(self, qb_url: str, username: str, password: str):
         self.qb_url = qb_url
-        self.qb = qbittorrentapi.Client(
-            host=qb_url, username=username, password=password
-        )
-        self.qb.auth_log_in()
 
         # 受此项目管理的种子所带有的分类名
         self.category = "ptbrush"
-        self._create_category(self.category)
+        self.qb = qb_client_pool.get(
+            qb_url,
+            username,
+            password,
+            setup=lambda client: self._create_category(self.category, client),
+        )
+
+    @property
+    def _sync_engine(self) -> QBSyncEngine:
+        return get_sync_engine(self.qb_url)
 
     @property
     def status(self) -> QBittorrentStatus:
-        result = self.qb.sync_maindata().server_state
+        self._sync_engine.sync(self.qb)
+        result = self._sync_engine.server_state
 
         return QBittorrentStatus(
-            dl_total_size=result.alltime_dl,
-            up_total_size=result.alltime_ul,
-            free_space_size=result.free_space_on_disk,
-            upspeed=result.up_info_speed,
-            dlspeed=result.dl_info_speed,
+            dl_total_size=result.get("alltime_dl", 0),
+            up_total_size=result.get("alltime_ul", 0),
+            free_space_size=result.get("free_space_on_disk", 0),
+            upspeed=result.get("up_info_speed", 0),
+            dlspeed=result.get("dl_info_speed", 0),
         )
 
+    @property
+    def _snapshot_key(self) -> Tuple[str, str]:
+        return (self.qb_url, self.category)
+
+    def invalidate_torrents(self):
+        torrent_snapshot_cache.invalidate(self._snapshot_key)
+
     @property
     def torrents(self) -> List[QBitorrentTorrent]:
-        # return []
+        cached = torrent_snapshot_cache.get(self._snapshot_key)
+        if cached is not None:
+            return cached
+        result = self._fetch_torrents()
+        torrent_snapshot_cache.put(self._snapshot_key, result)
+        return result
+
+    def _fetch_torrents(self) -> List[QBitorrentTorrent]:
+        self._sync_engine.sync(self.qb)
         result = []
-        for i in self.qb.torrents_info(category=self.category).data:
-            full_name = i.get("name")
-            match = re.search(r"__meta\.(.*?)\.(\d+)\.endTime\.([\d\-:]+)", full_name)
-            if match:
-                site, torrent_id, end_time_str = match.groups()
-                name = full_name[: match.start()]
-                try:
-                    end_time = datetime.strptime(end_time_str, "%Y-%m-%d-%H:%M:%S")
-                except ValueError as e:
-                    logger.error(f"Parse time error: {full_name} - {e}")
-                    end_time = datetime.now()
-            else:
-                name = full_name
-                site = ""
-                torrent_id = ""
+        for i in self._sync_engine.torrents(self.category):
+            name, site, torrent_id, end_time = _parse_meta_name(i.get("name", ""))
+            if end_time is None:
                 end_time = datetime.now()
 
             up_total_size = i.get("uploaded") if i.get("uploaded") else 0
             upspeed = i.get("upspeed") if i.get("upspeed") else 0
             dl_total_size = i.get("downloaded") if i.get("downloaded") else 0
             dlspeed = i.get("dlspeed") if i.get("dlspeed") else 0
-            completed = i.get("completion_on") > 0
+            completed = (i.get("completion_on") or 0) > 0
             torrent_hash = i.get("hash")
             size = i.get("size", 0)
             state = i.get("state", "")
@@ -116,16 +303,16 @@ class QBittorrent:
             )
         return result
 
-    def _create_category(self, category):
+    def _create_category(self, category, client: qbittorrentapi.Client):
         """
         编辑分类的保存路径, 分类不存在时则会创建
         :param category:
-        :param save_path:
+        :param client:
         :return:
         """
         try:
-            save_path = str(Path(self.qb.app_default_save_path()) / "_ptbrush")
-            self.qb.torrents_create_category(name=category, save_path=save_path)
+            save_path = str(Path(client.app_default_save_path()) / "_ptbrush")
+            client.torrents_create_category(name=category, save_path=save_path)
         except qbittorrentapi.exceptions.Conflict409Error:
             # 已经存在
             pass
@@ -147,10 +334,51 @@ class QBittorrent:
             rename=torrent_name,
             use_auto_torrent_management=True,
         )
+        self.invalidate_torrents()
         return res == "Ok."
 
+    def download_torrent_with_skipped_files(
+        self,
+        torrent_content: bytes,
+        torrent_name: str,
+        torrent_hash: str,
+        skipped_file_ids: List[int],
+    ) -> bool:
+        """
+        以暂停状态添加种子，设置好不下载的文件后再开始，qb不会分配或下载被跳过的文件
+
+        上传种子文件时不能使用 file_priorities 参数，所以添加后再单独设置文件优先级
+        """
+        res = self.qb.torrents_add(
+            torrent_files=torrent_content,
+            category=self.category,
+            rename=torrent_name,
+            use_auto_torrent_management=True,
+            is_stopped=True,
+        )
+        self.invalidate_torrents()
+        if res != "Ok.":
+            return False
+
+        # 添加是异步的，种子可能还没有出现在qb中
+        for _ in range(10):
+            try:
+                self.set_no_download_files(torrent_hash, skipped_file_ids)
+                break
+            except qbittorrentapi.exceptions.NotFound404Error:
+                time.sleep(0.5)
+        else:
+            logger.error(f"设置种子{torrent_name}的文件优先级失败，删除该种子")
+            self.delete_torrent(torrent_hash)
+            return False
+
+        self.qb.torrents_start(torrent_hashes=torrent_hash)
+        self.invalidate_torrents()
+        return True
+
     def delete_torrent(self, torrent_hash: str):
         self.qb.torrents_delete(delete_files=True, torrent_hashes=[torrent_hash])
+        self.invalidate_torrents()
 
     def cancel_download(self, torrent_hash: str):
         """
@@ -159,6 +387,7 @@ class QBittorrent:
         files = self.get_torrent_files(torrent_hash)
         file_ids = [file["index"] for file in files]
         self.set_no_download_files(torrent_hash, file_ids)
+        self.invalidate_torrents()
         # self.qb.torrents_delete(delete_files=True, torrent_hashes=[torrent_hash])
 
     def get_torrent_files(self, hash: str) -> List[dict]:
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   stats.py
+@Time    :   2026/10/18 10:12:40
+@Version :   1.0
+@Desc    :   Dashboard统计数据的物化缓存
+"""
+
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+import json
+import threading
+from typing import Dict, List, Optional, Tuple, Type
+
+import peewee
+from loguru import logger
+
+from db import QBStatus, Torrent, TorrentEvent, db_writer
+from events import event_broker
+
+
+class DashboardStats:
+    """
+    Dashboard统计数据的物化缓存
+
+    由产生数据的任务增量刷新：
+    - QB状态、添加/删除种子的事件在写入数据库后通过 db_writer 的订阅回调更新
+    - 活跃种子数在qb种子采样任务完成后刷新
+    - 各统计周期的起点流量在时序数据聚合任务完成后刷新
+    接口直接返回缓存好的JSON，不再查询数据库，数据变化时通过SSE推送。
+    """
+
+    PERIODS = {"1d": 1, "3d": 3, "7d": 7}
+    EVENT_CATEGORIES = ("ADD_TORRENT", "DELETE_TORRENT")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+
+        self._status: Optional[dict] = None
+        self._active_count = 0
+        # 各类事件的发生时间，按时间升序，只保留最长统计周期内的
+        self._events: Dict[str, List[datetime]] = {c: [] for c in self.EVENT_CATEGORIES}
+        # 各统计周期起点时的 (累计上传, 累计下载)
+        self._past_totals: Dict[str, Tuple[int, int]] = {}
+
+        self.version = 0
+        self._payload = ""
+
+    def payload(self) -> str:
+        """
+        当前统计数据的JSON
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return self._payload
+
+    def on_rows_written(self, rows: List[Tuple[Type[peewee.Model], dict]]):
+        """
+        db_writer 写入回调，从新写入的行中更新QB状态和事件计数
+        """
+        changed = False
+        with self._lock:
+            if not self._loaded:
+                return
+            for model, row in rows:
+                if model is QBStatus:
+                    if not self._status or row["created_time"] >= self._status["created_time"]:
+                        self._status = self._status_from_row(row)
+                        changed = True
+                elif model is TorrentEvent and row.get("category") in self._events:
+                    insort(self._events[row["category"]], row["created_time"])
+                    changed = True
+            if changed:
+                self._rebuild()
+
+    def refresh_active_count(self):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._active_count = Torrent.select().where(Torrent.brushed == True).count()
+            self._rebuild()
+
+    def refresh_periods(self):
+        """
+        刷新各统计周期的起点流量，并丢弃已超出统计周期的事件
+        """
+        from tasks.services import RollupService
+
+        with self._lock:
+            if not self._loaded:
+                return
+            self._load_past_totals(RollupService())
+            cutoff = datetime.now() - timedelta(days=max(self.PERIODS.values()))
+            for times in self._events.values():
+                del times[: bisect_left(times, cutoff)]
+            self._rebuild()
+
+    def _load(self):
+        from tasks.services import RollupService
+
+        latest = QBStatus.select().order_by(QBStatus.created_time.desc()).first()
+        self._status = self._status_from_row(latest.__data__) if latest else None
+        self._active_count = Torrent.select().where(Torrent.brushed == True).count()
+
+        cutoff = datetime.now() - timedelta(days=max(self.PERIODS.values()))
+        query = (
+            TorrentEvent.select(TorrentEvent.category, TorrentEvent.created_time)
+            .where(
+                (TorrentEvent.created_time >= cutoff)
+                & (TorrentEvent.category.in_(self.EVENT_CATEGORIES))
+            )
+            .order_by(TorrentEvent.created_time.asc())
+        )
+        for event in query:
+            self._events[event.category].append(event.created_time)
+
+        self._load_past_totals(RollupService())
+        self._loaded = True
+        self._rebuild()
+        logger.debug("Dashboard统计数据已加载")
+
+    @staticmethod
+    def _status_from_row(row: dict) -> dict:
+        # 写入队列中的行只包含显式赋值的字段，缺省字段补0
+        return {
+            "created_time": row["created_time"],
+            "upspeed": row.get("upspeed", 0),
+            "dlspeed": row.get("dlspeed", 0),
+            "up_total_size": row.get("up_total_size", 0),
+            "dl_total_size": row.get("dl_total_size", 0),
+            "free_space_size": row.get("free_space_size", 0),
+        }
+
+    def _load_past_totals(self, rollup_service):
+        now = datetime.now()
+        for p_name, days in self.PERIODS.items():
+            totals = rollup_service.qb_totals_at(now - timedelta(days=days))
+            if totals:
+                self._past_totals[p_name] = totals
+            else:
+                self._past_totals.pop(p_name, None)
+
+    def _rebuild(self):
+        if not self._status:
+            data = {
+                "status": {
+                    "upspeed": 0,
+                    "dlspeed": 0,
+                    "free_space": 0,
+                    "active_count": 0,
+                },
+                "period_stats": {},
+            }
+        else:
+            now = datetime.now()
+            period_stats = {}
+            for p_name, days in self.PERIODS.items():
+                start_time = now - timedelta(days=days)
+                added = self._count_since("ADD_TORRENT", start_time)
+                deleted = self._count_since("DELETE_TORRENT", start_time)
+
+                up_traffic = 0
+                dl_traffic = 0
+                if p_name in self._past_totals:
+                    past_up_total, past_dl_total = self._past_totals[p_name]
+                    up_traffic = max(0, self._status["up_total_size"] - past_up_total)
+                    dl_traffic = max(0, self._status["dl_total_size"] - past_dl_total)
+
+                period_stats[p_name] = {
+                    "added_count": added,
+                    "deleted_count": deleted,
+                    "upload_traffic": up_traffic,
+                    "download_traffic": dl_traffic,
+                }
+
+            data = {
+                "status": {
+                    "upspeed": self._status["upspeed"],
+                    "dlspeed": self._status["dlspeed"],
+                    "free_space": self._status["free_space_size"],
+                    "active_count": self._active_count,
+                    "timestamp": self._status["created_time"].strftime(
+                        "%Y-%m-%d %H:%M:%S"
+                    ),
+                },
+                "period_stats": period_stats,
+            }
+
+        self._payload = json.dumps(data)
+        self.version += 1
+        event_broker.publish("dashboard", self._payload)
+
+    def _count_since(self, category: str, start_time: datetime) -> int:
+        times = self._events[category]
+        return len(times) - bisect_left(times, start_time)
+
+
+dashboard_stats = DashboardStats()
+db_writer.subscribe(dashboard_stats.on_rows_written)
+event_broker.register("dashboard", dashboard_stats.payload)
@@ -9,10 +9,20 @@
 
 # here put the import lib
 from datetime import datetime, timedelta
-from time import sleep
+from pathlib import Path
 from loguru import logger
-from tasks.services import PtTorrentService, QBTorrentService, BrushService
+from tasks.services import (
+    PtTorrentService,
+    QBTorrentService,
+    BrushService,
+    RollupService,
+)
 from db import SystemMessage
+from stats import dashboard_stats
+from events import event_broker
+
+# 日志文件所在目录
+LOG_DIR = Path(__file__).parent.parent / "data"
 
 
 # 给所有任务加一个装饰器，进行错误捕获
@@ -29,15 +39,23 @@ def catch_error(func):
 
 
 # 抓取PT站种子
+# 任务中途出错时已经写入的数据同样需要推送，因此通知放在 finally 中
 @catch_error
 def fetch_pt_torrents():
-    PtTorrentService().fetcher()
+    try:
+        PtTorrentService().fetcher()
+    finally:
+        event_broker.notify("torrents")
 
 
 # 抓取QB中的种子信息
 @catch_error
 def fetch_qb_torrents():
-    QBTorrentService().fetcher()
+    try:
+        QBTorrentService().fetcher()
+    finally:
+        dashboard_stats.refresh_active_count()
+        event_broker.notify("torrents")
 
 
 # 抓取QB的信息
@@ -49,23 +67,35 @@ def fetch_qb_status():
 # 刷流
 @catch_error
 def brush():
-    add_torrent_count = BrushService().brush()
-    if add_torrent_count > 0:
-        logger.info(f"1分钟后,开始拆包任务...")
-        sleep(60)
+    brush_service = BrushService()
+    # 出错前可能已经添加了种子
+    changed = True
+    try:
+        changed = brush_service.brush() > 0
+    finally:
+        if changed:
+            event_broker.notify("torrents")
+    # 大包种子在添加时已经按种子文件选好了文件，只有种子文件无法解析时才需要事后瘦身
+    if brush_service.unplanned_count > 0:
         QBTorrentService().torrent_thinned()
 
 
 # 清理长时间没有上传的种子
 @catch_error
 def clean_long_time_no_activate_torrents():
-    QBTorrentService().clean_long_time_no_activate()
+    try:
+        QBTorrentService().clean_long_time_no_activate()
+    finally:
+        event_broker.notify("torrents")
 
 
 # 清理即将过期种子
 @catch_error
 def clean_will_expire_torrents():
-    QBTorrentService().clean_will_expired()
+    try:
+        QBTorrentService().clean_will_expired()
+    finally:
+        event_broker.notify("torrents")
 
 
 # 对大包种子进行瘦身
@@ -77,7 +107,23 @@ def torrent_thinned():
 # 检查磁盘空间并清理
 @catch_error
 def check_disk_space_and_cleanup():
-    QBTorrentService().check_disk_space_and_cleanup()
+    try:
+        QBTorrentService().check_disk_space_and_cleanup()
+    finally:
+        event_broker.notify("torrents")
+
+
+# 时序数据降采样
+@catch_error
+def rollup_time_series():
+    RollupService().rollup()
+    dashboard_stats.refresh_periods()
+
+
+# 清理过期的时序数据
+@catch_error
+def prune_time_series():
+    RollupService().prune()
 
 
 # 清理系统的系统日志
@@ -86,13 +132,13 @@ def clean_db_logs(hours=24):
     cutoff = datetime.now() - timedelta(hours=hours)
     # 如果hours=0，则清理所有 (cutoff > created_time) -> created_time < now -> all past logs.
     count = SystemMessage.delete().where(SystemMessage.created_time < cutoff).execute()
+    event_broker.bump("logs")
 
     # 同时清理物理日志文件
     import glob
     import os
-    from pathlib import Path
 
-    log_dir = Path(__file__).parent.parent / "data"
+    log_dir = LOG_DIR
     log_file = log_dir / "ptbrush.log"
 
     # 1. 清空主日志文件 (使用截断而非删除，防止文件占用报错)
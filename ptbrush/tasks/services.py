@@ -9,69 +9,240 @@
 
 from datetime import datetime, timedelta
 import re
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple, Type
 from loguru import logger
-from config.config import PTBrushConfig, SiteModel
-from model import Torrent
-from db import Torrent as TorrentDB, BrushTorrent, QBStatus, SystemMessage, database
+from config.config import SiteModel, get_config
+from model import SearchPage, Torrent, Watermark
+from db import (
+    Torrent as TorrentDB,
+    BrushTorrent,
+    QBStatus,
+    QBStatusRollup,
+    BrushTorrentRollup,
+    RollupModel,
+    SiteWatermark,
+    SystemMessage,
+    TorrentEvent,
+    database,
+    db_writer,
+    optimize_database,
+)
 from qbittorrent import QBittorrent
+from bencode import BencodeError, parse_metainfo, plan_skipped_files
 from ptsite import TorrentFetch
+from torrent_cache import torrent_cache
 import peewee
 
 
+def record_torrent_event(category: str, name: str):
+    """
+    记录添加/删除刷流种子的事件，用于Dashboard统计
+    """
+    db_writer.insert(TorrentEvent, category=category, name=name)
+
+
 # 从PT站获取种子
 class PtTorrentService:
-    def fetcher(self):
+    # 每批写入的种子数，与站点单页种子数一致
+    BATCH_SIZE = 200
+    # 搜索深度统计的指数移动平均系数
+    STATS_ALPHA = 0.2
+
+    def fetcher(self, full_refresh: bool = False):
         """
         抓取种子，并进行存储
+
+        有水位的分类只增量抓取新种子，超过全量刷新间隔的分类重新全量搜索
         """
-        sites = PTBrushConfig().sites
+        config = get_config()
+        sites = config.sites
+        refresh_interval = timedelta(minutes=config.brush.pt_full_refresh_interval)
         logger.info(f"开始抓取PT站点FREE种子，准备处理{len(sites)}个站点")
         count = 0
         for site in sites:
             logger.info(f"开始处理站点:{site.name}, 正在初始化抓取器...")
-            torrent_fetcher = TorrentFetch(
-                site.name, cookie=site.cookie, headers=site.headers
+            torrent_fetcher = TorrentFetch.from_config(site)
+            categories, watermarks = self._plan_categories(
+                site.name, torrent_fetcher, full_refresh, refresh_interval
             )
-            for torrent in torrent_fetcher.free_torrents:
-                logger.info(
-                    f"从{site.name}抓取到种子: {torrent.name}, 大小: {torrent.size / 1024 / 1024:.2f}MB, 做种数: {torrent.seeders}, 下载数: {torrent.leechers}, 评分: {torrent.score}"
-                )
-                self._insert_or_update_torrent(torrent)
-                count += 1
+            if not categories:
+                logger.info(f"站点{site.name}没有需要抓取的分类")
+                continue
+            full = [c for c in categories if c not in watermarks]
+            logger.info(
+                f"站点{site.name} 全量搜索: {','.join(full) or '无'}, 增量抓取: {','.join(watermarks) or '无'}"
+            )
+            # 每个分类的搜索结果返回后立即入库，新种可以更早进入刷流候选
+            for page in torrent_fetcher.free_torrent_pages(categories, watermarks):
+                for torrent in page.torrents:
+                    logger.info(
+                        f"从{site.name}抓取到种子: {torrent.name}, 大小: {torrent.size / 1024 / 1024:.2f}MB, 做种数: {torrent.seeders}, 下载数: {torrent.leechers}, 评分: {torrent.score}"
+                    )
+                count += len(page.torrents)
+                for batch in peewee.chunked(page.torrents, self.BATCH_SIZE):
+                    self._upsert_torrents(batch)
+                self._save_watermark(site.name, page)
             logger.info(f"站点{site.name}处理完成，已抓取{count}个种子")
         logger.info(f"抓取PT站点FREE种子完成，本轮共抓取到{count}个种子")
 
-    def _insert_or_update_torrent(self, torrent: Torrent):
-        updated_time = datetime.now()
+    def _plan_categories(
+        self,
+        site: str,
+        torrent_fetcher: TorrentFetch,
+        full_refresh: bool,
+        refresh_interval: timedelta,
+    ) -> Tuple[List[str], Dict[str, Watermark]]:
+        """
+        决定本轮要搜索的分类，返回 (分类列表, 增量抓取分类的水位)
+        不在水位中的分类全量搜索；不支持增量且未到刷新时间的分类(如排行榜)跳过
+        """
+        marks = {
+            mark.category: mark
+            for mark in SiteWatermark.select().where(SiteWatermark.site == site)
+        }
+        now = datetime.now()
+        categories: List[str] = []
+        watermarks: Dict[str, Watermark] = {}
+        for category in torrent_fetcher.categories:
+            mark = marks.get(category)
+            due = (
+                full_refresh
+                or mark is None
+                or mark.last_full_refresh is None
+                or now - mark.last_full_refresh >= refresh_interval
+            )
+            if due:
+                categories.append(category)
+            elif (
+                category in torrent_fetcher.incremental_categories
+                and mark.newest_torrent_id is not None
+            ):
+                categories.append(category)
+                watermarks[category] = Watermark(
+                    torrent_id=mark.newest_torrent_id,
+                    created_time=mark.newest_created_time,
+                )
+        return categories, watermarks
+
+    def _save_watermark(self, site: str, page: SearchPage):
+        """
+        只前移水位，全量搜索成功时记录刷新时间
+
+        增量搜索没有接上旧水位就停止时，中间的种子还没有扫描过，
+        保留旧水位并让该分类下一轮全量搜索，否则这些种子会一直被跳过
+        """
+        if page.failed:
+            return
+        mark, _ = SiteWatermark.get_or_create(site=site, category=page.category)
+        if (
+            page.watermark
+            and (page.full or page.complete)
+            and (
+                mark.newest_created_time is None
+                or page.watermark.created_time >= mark.newest_created_time
+            )
+        ):
+            mark.newest_torrent_id = page.watermark.torrent_id
+            mark.newest_created_time = page.watermark.created_time
+        if page.full and page.complete:
+            mark.last_full_refresh = datetime.now()
+        elif not page.full and not page.complete:
+            logger.info(f"站点{site}分类{page.category}增量搜索未达到水位，下一轮全量搜索")
+            mark.last_full_refresh = None
+
+        # 深度统计，第一次搜索直接作为平均值
+        page_yield = page.candidates / page.pages if page.pages else 0
+        if mark.searches:
+            alpha = self.STATS_ALPHA
+            mark.avg_depth = (1 - alpha) * mark.avg_depth + alpha * page.pages
+            mark.avg_yield = (1 - alpha) * mark.avg_yield + alpha * page_yield
+        else:
+            mark.avg_depth = page.pages
+            mark.avg_yield = page_yield
+        mark.searches += 1
+        mark.last_depth = page.pages
+        mark.last_items = page.items
+        mark.last_candidates = page.candidates
+
+        mark.updated_time = datetime.now()
+        mark.save()
         logger.info(
-            f"正在更新种子信息: 站点={torrent.site}, ID={torrent.id}, 名称={torrent.name}"
+            f"站点{site}分类{page.category}{'全量' if page.full else '增量'}搜索{page.pages}页，扫描{page.items}个种子，刷流候选{page.candidates}个"
+        )
+
+    def _upsert_torrents(self, torrents: List[Torrent]) -> int:
+        """
+        批量写入种子，做种数、下载数、free结束时间均未变化的种子直接跳过，
+        返回实际写入的种子数
+        """
+        # 同一批次中重复的种子以最后一次为准
+        unique = {(t.site, str(t.id)): t for t in torrents}
+
+        existing = {}
+        query = TorrentDB.select(
+            TorrentDB.site,
+            TorrentDB.torrent_id,
+            TorrentDB.seeders,
+            TorrentDB.leechers,
+            TorrentDB.free_end_time,
+        ).where(
+            TorrentDB.site.in_({site for site, _ in unique})
+            & TorrentDB.torrent_id.in_([torrent_id for _, torrent_id in unique])
         )
-        TorrentDB.insert(
-            name=torrent.name,
-            site=torrent.site,
-            torrent_id=torrent.id,
-            leechers=torrent.leechers,
-            seeders=torrent.seeders,
-            size=torrent.size,
-            free_end_time=torrent.free_end_time,
-            score=torrent.score,
-        ).on_conflict(
-            conflict_target=[TorrentDB.site, TorrentDB.torrent_id],
-            update=dict(
-                updated_time=updated_time,
-                leechers=torrent.leechers,
-                seeders=torrent.seeders,
-                free_end_time=torrent.free_end_time,
-                score=torrent.score,
-            ),
-        ).execute()
+        for row in query:
+            existing[(row.site, row.torrent_id)] = (
+                row.seeders,
+                row.leechers,
+                row.free_end_time,
+            )
+
+        rows = []
+        for key, torrent in unique.items():
+            if existing.get(key) == (
+                torrent.seeders,
+                torrent.leechers,
+                torrent.free_end_time,
+            ):
+                continue
+            rows.append(
+                dict(
+                    name=torrent.name,
+                    site=torrent.site,
+                    torrent_id=str(torrent.id),
+                    leechers=torrent.leechers,
+                    seeders=torrent.seeders,
+                    size=torrent.size,
+                    free_end_time=torrent.free_end_time,
+                    score=torrent.score,
+                )
+            )
+
+        logger.info(
+            f"批量更新种子信息: 本批{len(unique)}个种子，其中{len(rows)}个有变化"
+        )
+        if not rows:
+            return 0
+
+        updated_time = datetime.now()
+        with database.atomic():
+            for chunk in peewee.chunked(rows, 100):
+                TorrentDB.insert_many(chunk).on_conflict(
+                    conflict_target=[TorrentDB.site, TorrentDB.torrent_id],
+                    preserve=[
+                        TorrentDB.leechers,
+                        TorrentDB.seeders,
+                        TorrentDB.free_end_time,
+                        TorrentDB.score,
+                    ],
+                    update={TorrentDB.updated_time: updated_time},
+                ).execute()
+        return len(rows)
 
 
 # 从qb获取种子状态、以及下载器状态、 清理临近过期的种子
 class QBTorrentService:
     def __init__(self):
-        self._config = PTBrushConfig()
+        self._config = get_config()
         self._qb = QBittorrent(
             self._config.downloader.url,
             self._config.downloader.username,
@@ -86,7 +257,8 @@ class QBTorrentService:
         logger.info(
             f"正在记录QB状态 - 上传速度: {qb_status.upspeed / 1024 / 1024:.2f}MB/s, 下载速度: {qb_status.dlspeed / 1024 / 1024:.2f}MB/s, 剩余空间: {qb_status.free_space_size / 1024 / 1024 / 1024:.2f}GB"
         )
-        QBStatus.create(
+        db_writer.insert(
+            QBStatus,
             dlspeed=qb_status.dlspeed,
             upspeed=qb_status.upspeed,
             free_space_size=qb_status.free_space_size,
@@ -119,6 +291,7 @@ class QBTorrentService:
 
             # 直接删除种子
             self._qb.cancel_download(torrent.hash)
+            record_torrent_event("DELETE_TORRENT", torrent.name)
             count += 1
             logger.bind(category="DELETE_TORRENT").info(
                 f"即将过期，删除种子: {torrent.name}"
@@ -154,6 +327,9 @@ class QBTorrentService:
                     "free_end_time": torrent.free_end_time,
                 },
             )
+            if not torrent_db.brushed:
+                # 之前已标记为停止刷流，重新计算无活动时间
+                torrent_db.last_active_at = None
             torrent_db.brushed = True
 
             # 更新分数等信息，虽然这些可能不会变，但保持最新比较好
@@ -163,10 +339,20 @@ class QBTorrentService:
 
             # 始终更新关键字段
             torrent_db.size = torrent.size
+
+            # 更新最新状态，第一次采样作为无活动计时的起点
+            now = datetime.now()
+            if torrent_db.last_active_at is None or torrent.upspeed or torrent.dlspeed:
+                torrent_db.last_active_at = now
+            torrent_db.last_upspeed = torrent.upspeed
+            torrent_db.last_dlspeed = torrent.dlspeed
+            torrent_db.last_up_total = torrent.up_total_size
+            torrent_db.last_dl_total = torrent.dl_total_size
             torrent_db.save()
 
-            BrushTorrent.create(
-                torrent=torrent_db,
+            db_writer.insert(
+                BrushTorrent,
+                torrent=torrent_db.id,
                 up_total_size=torrent.up_total_size,
                 upspeed=torrent.upspeed,
                 dl_total_size=torrent.dl_total_size,
@@ -196,38 +382,22 @@ class QBTorrentService:
         清理长时间未活动的种子
         """
         logger.info(f"开始清理长时间未活动的种子")
-        qb_torrents = self._qb.torrents
+        qb_torrents = {(i.site, str(i.torrent_id)): i for i in self._qb.torrents}
 
-        # 统计出所有正在刷流以及历史刷流的种子ID
-        brush_torrents = BrushTorrent.select().group_by(BrushTorrent.torrent)
-        torrents = set([brush_torrent.torrent for brush_torrent in brush_torrents])
-        logger.info(f"当前数据库中共有{len(torrents)}个种子记录需要检查")
+        # 只检查正在刷流的种子，活动状态由qb种子采样任务维护在种子表中
+        torrents = list(TorrentDB.select().where(TorrentDB.brushed == True))
+        logger.info(f"当前数据库中共有{len(torrents)}个刷流中的种子需要检查")
 
         # 处理每个torrent
         cleaned_count = 0
         for torrent in torrents:
-            # 查询出所有记录
-            brush_torrent_records = list(
-                BrushTorrent.select()
-                .where(BrushTorrent.torrent == torrent)
-                .order_by(BrushTorrent.created_time.asc())
-            )
-            if not brush_torrent_records:
-                continue
-
             # 查询对应的qb中的种子
-            target_qb_torrent = [
-                i
-                for i in qb_torrents
-                if i.site == torrent.site
-                and str(i.torrent_id) == str(torrent.torrent_id)
-            ]
+            target_qb_torrent = qb_torrents.get((torrent.site, str(torrent.torrent_id)))
             if not target_qb_torrent:
                 # qb中已经删除了此种子，则删除记录
                 logger.info(f"种子 {torrent.name} 在QB中已不存在，清理相关记录")
-                BrushTorrent.delete().where(BrushTorrent.torrent == torrent).execute()
+                BrushTorrent.delete().where(BrushTorrent.torrent == torrent.id).execute()
                 continue
-            target_qb_torrent = target_qb_torrent[0]
 
             # 策略调整：发现排队或错误状态种子直接删除
             if target_qb_torrent.state in [
@@ -239,8 +409,9 @@ class QBTorrentService:
                 logger.info(
                     f"发现排队/错误种子: {torrent.name} ({target_qb_torrent.state})，执行直接删除"
                 )
-                BrushTorrent.delete().where(BrushTorrent.torrent == torrent).execute()
+                BrushTorrent.delete().where(BrushTorrent.torrent == torrent.id).execute()
                 self._qb.delete_torrent(target_qb_torrent.hash)
+                record_torrent_event("DELETE_TORRENT", torrent.name)
                 cleaned_count += 1
                 logger.bind(category="DELETE_TORRENT").info(
                     f"异常清理: {torrent.name} ({target_qb_torrent.state})"
@@ -262,22 +433,20 @@ class QBTorrentService:
                 )
                 continue
 
-            latest_record = brush_torrent_records.pop()
-
-            if latest_record.upspeed != 0 or latest_record.dlspeed != 0:
+            if torrent.last_upspeed != 0 or torrent.last_dlspeed != 0:
                 # 跳过正在活动的种子
                 logger.info(
-                    f"种子活动中: {torrent.name} (UP:{latest_record.upspeed}/DL:{latest_record.dlspeed})"
+                    f"种子活动中: {torrent.name} (UP:{torrent.last_upspeed}/DL:{torrent.last_dlspeed})"
                 )
                 continue
 
-            end_time = latest_record.created_time
-            # 统计出无活动的持续时间
-            while brush_torrent_records:
-                latest_record = brush_torrent_records.pop()
-                if latest_record.upspeed != 0 or latest_record.dlspeed != 0:
-                    break
-            start_time = latest_record.created_time
+            if torrent.last_active_at is None:
+                # 还没有采样过
+                continue
+
+            # 无活动的起点为最后一次有速度的采样，从未活动过则为第一次采样
+            start_time = torrent.last_active_at
+            end_time = datetime.now()
             if self._config.brush.max_no_activate_time < 5:
                 # logger.warning(f"max_no_activate_time配置值小于5分钟，使用默认值5分钟")
                 max_no_activate_time = 5
@@ -293,24 +462,17 @@ class QBTorrentService:
                 logger.info(
                     f"清理无活动种子: {torrent.name}, 无活动时长: {inactive_duration:.1f}分钟, 超过配置阈值: {max_no_activate_time}分钟"
                 )
-                BrushTorrent.delete().where(BrushTorrent.torrent == torrent).execute()
+                BrushTorrent.delete().where(BrushTorrent.torrent == torrent.id).execute()
                 self._qb.delete_torrent(target_qb_torrent.hash)
+                record_torrent_event("DELETE_TORRENT", torrent.name)
                 cleaned_count += 1
                 logger.bind(category="DELETE_TORRENT").info(
                     f"无活动清理: {torrent.name} ({inactive_duration:.0f}min)"
                 )
 
-        logger.info(f"开始清理brushtorrent表7天前的历史记录...")
-        old_records = (
-            BrushTorrent.delete()
-            .where(BrushTorrent.created_time < (datetime.now() - timedelta(days=7)))
-            .execute()
-        )
-        logger.info(f"已清理{old_records}条7天前的历史记录")
-
-        # 对数据库瘦身
-        logger.info("开始对数据库进行瘦身优化...")
-        database.execute_sql("VACUUM;")
+        # 数据库维护，WAL模式下不再执行会长时间锁库的VACUUM
+        logger.info("开始对数据库进行维护优化...")
+        optimize_database()
 
         if cleaned_count > 0:
             logger.bind(category="DELETE_TORRENT").info(
@@ -338,7 +500,8 @@ class QBTorrentService:
         logger.warning(
             f"磁盘空间不足 (剩余: {current_free_space / 1024 / 1024 / 1024:.2f}GB, 阈值: {min_disk_space / 1024 / 1024 / 1024:.2f}GB)，开始执行清理策略"
         )
-        SystemMessage.create(
+        db_writer.insert(
+            SystemMessage,
             message_type="WARNING",
             category="SYSTEM",
             content=f"磁盘空间不足 (剩余: {current_free_space / 1024 / 1024 / 1024:.2f}GB)，开始执行清理策略",
@@ -396,6 +559,7 @@ class QBTorrentService:
 
             # 删除种子
             self._qb.delete_torrent(cand["hash"])
+            record_torrent_event("DELETE_TORRENT", cand["name"])
 
             if cand["site"] and cand["torrent_id"]:
                 site = cand["site"]
@@ -421,8 +585,11 @@ class QBTorrentService:
         if deleted_count > 0:
             msg = f"磁盘空间清理完成，共删除 {deleted_count} 个种子，释放 {freed_space / 1024 / 1024:.2f}MB 空间"
             logger.info(msg)
-            SystemMessage.create(
-                message_type="SUCCESS", category="DELETE_TORRENT", content=msg
+            db_writer.insert(
+                SystemMessage,
+                message_type="SUCCESS",
+                category="DELETE_TORRENT",
+                content=msg,
             )
 
     def torrent_thinned(self):
@@ -444,26 +611,20 @@ class QBTorrentService:
                 f"正在处理大包种子: {torrent.name}, 大小: {torrent.size / 1024 / 1024 / 1024:.2f}GB"
             )
             files = self._qb.get_torrent_files(torrent.hash)
-            all_file_ids = [file["index"] for file in files]
-
-            current_size = sum(
-                [file["size"] for file in files if file["priority"] != 0]
+            download_files = [file for file in files if file["priority"] != 0]
+            skipped, current_size = plan_skipped_files(
+                [file["size"] for file in download_files],
+                self._config.brush.torrent_max_size,
             )
-
-            download_file_ids = []
+            skipped_file_ids = {download_files[i]["index"] for i in skipped}
             total_files = len(files)
-            selected_files = 0
-            for file in files:
-                if file["priority"] != 0:
-                    if current_size > self._config.brush.torrent_max_size:
-                        # 超出了大小限制，将文件设置为不下载
-                        file["priority"] = 0
-                        current_size -= file["size"]
-                    else:
-                        download_file_ids.append(file["index"])
-                        selected_files += 1
-
-            no_download_file_ids = list(set(all_file_ids) - set(download_file_ids))
+            selected_files = len(download_files) - len(skipped)
+
+            no_download_file_ids = [
+                file["index"]
+                for file in files
+                if file["priority"] == 0 or file["index"] in skipped_file_ids
+            ]
 
             self._qb.set_no_download_files(torrent.hash, no_download_file_ids)
             logger.info(
@@ -475,15 +636,315 @@ class QBTorrentService:
         # logger.info(torrent.size)
 
 
+# 时序数据降采样，原始采样只保留较短时间，长期统计从聚合桶中读取
+class RollupService:
+    # 聚合级别: (桶大小, 数据来源的桶大小(0表示原始采样), 保留时长)，单位秒
+    LEVELS = [
+        (60, 0, timedelta(days=7)),
+        (900, 60, timedelta(days=30)),
+        (3600, 900, timedelta(days=365)),
+    ]
+
+    # 原始采样保留时长
+    RAW_RETENTION = timedelta(days=1)
+    # 添加/删除种子事件保留时长，需覆盖Dashboard最长的统计周期
+    EVENT_RETENTION = timedelta(days=30)
+
+    SPEED_FIELDS = ("upspeed", "dlspeed")
+    TOTAL_FIELDS = ("up_total", "dl_total")
+
+    def rollup(self):
+        """
+        把新增的原始采样逐级聚合到各个级别的桶中，每个级别从已有的最新桶开始重新计算，
+        因此最新的未完成桶会在下一次执行时被补全
+        """
+        for resolution, source, _ in self.LEVELS:
+            start = self._watermark(QBStatusRollup, resolution)
+            if source:
+                rows = self._rollup_rows(QBStatusRollup, source, start)
+            else:
+                rows = self._raw_qb_status_rows(start)
+            qb_count = self._save(
+                QBStatusRollup, self._merge(rows, resolution, keys=())
+            )
+
+            start = self._watermark(BrushTorrentRollup, resolution)
+            if source:
+                rows = self._rollup_rows(BrushTorrentRollup, source, start)
+            else:
+                rows = self._raw_brush_torrent_rows(start)
+            torrent_count = self._save(
+                BrushTorrentRollup, self._merge(rows, resolution, keys=("torrent",))
+            )
+            logger.debug(
+                f"时序数据聚合完成 - 粒度: {resolution}s, QB状态桶: {qb_count}, 种子状态桶: {torrent_count}"
+            )
+
+    def prune(self):
+        """
+        清理过期的原始采样以及聚合桶，还没有聚合过的原始采样不会被清理
+        """
+        now = datetime.now()
+        raw_cutoff = now - self.RAW_RETENTION
+        first_resolution = self.LEVELS[0][0]
+
+        # 还没有任何聚合桶时不清理，最新桶之后的原始采样下一次聚合还要使用
+        qb_count = 0
+        qb_watermark = self._watermark(QBStatusRollup, first_resolution)
+        if qb_watermark:
+            qb_count = (
+                QBStatus.delete()
+                .where(QBStatus.created_time < min(raw_cutoff, qb_watermark))
+                .execute()
+            )
+
+        torrent_count = 0
+        torrent_watermark = self._watermark(BrushTorrentRollup, first_resolution)
+        if torrent_watermark:
+            torrent_count = (
+                BrushTorrent.delete()
+                .where(BrushTorrent.created_time < min(raw_cutoff, torrent_watermark))
+                .execute()
+            )
+
+        event_count = (
+            TorrentEvent.delete()
+            .where(TorrentEvent.created_time < now - self.EVENT_RETENTION)
+            .execute()
+        )
+
+        rollup_count = 0
+        for resolution, _, retention in self.LEVELS:
+            for model in (QBStatusRollup, BrushTorrentRollup):
+                rollup_count += (
+                    model.delete()
+                    .where(
+                        (model.resolution == resolution)
+                        & (model.bucket_start < now - retention)
+                    )
+                    .execute()
+                )
+        logger.info(
+            f"时序数据清理完成 - QB状态原始记录: {qb_count}条, 种子状态原始记录: {torrent_count}条, 过期聚合桶: {rollup_count}个, 种子事件: {event_count}条"
+        )
+
+    def cycle_speed(self, start_time: datetime) -> Tuple[Optional[float], Optional[int]]:
+        """
+        统计 start_time 至今qb的 (平均上传速度, 最大下载速度)，没有数据时返回 (None, None)
+
+        完整落在统计区间内的桶读取最细粒度的聚合结果，其余部分读取原始采样：
+        start_time 所在的不完整桶，以及最新桶(下一次聚合时还会补入迟到的采样)及之后
+        """
+        resolution = self.LEVELS[0][0]
+        head_end = self._bucket_start(start_time, resolution)
+        if head_end < start_time:
+            head_end += timedelta(seconds=resolution)
+        newest = self._watermark(QBStatusRollup, resolution)
+
+        buckets = []
+        raw_query = QBStatus.select(QBStatus.upspeed, QBStatus.dlspeed)
+        if newest is not None and newest > head_end:
+            buckets = list(
+                QBStatusRollup.select(
+                    QBStatusRollup.samples,
+                    QBStatusRollup.upspeed_avg,
+                    QBStatusRollup.dlspeed_max,
+                ).where(
+                    (QBStatusRollup.resolution == resolution)
+                    & (QBStatusRollup.bucket_start >= head_end)
+                    & (QBStatusRollup.bucket_start < newest)
+                )
+            )
+            raw_query = raw_query.where(
+                (
+                    (QBStatus.created_time >= start_time)
+                    & (QBStatus.created_time < head_end)
+                )
+                | (QBStatus.created_time >= newest)
+            )
+        else:
+            raw_query = raw_query.where(QBStatus.created_time >= start_time)
+        raw = list(raw_query)
+
+        samples = sum(i.samples for i in buckets) + len(raw)
+        if not samples:
+            return None, None
+        upspeed_sum = sum(i.upspeed_avg * i.samples for i in buckets) + sum(
+            i.upspeed for i in raw
+        )
+        dlspeed_max = max(
+            [i.dlspeed_max for i in buckets] + [i.dlspeed for i in raw]
+        )
+        return upspeed_sum / samples, dlspeed_max
+
+    def qb_totals_at(self, at: datetime) -> Optional[Tuple[int, int]]:
+        """
+        某个时间点qb的 (累计上传, 累计下载)，取该时间点之前最近的聚合桶，
+        该时间点之前没有数据时取最早的记录
+        """
+        for resolution, _, _ in self.LEVELS:
+            bucket = (
+                QBStatusRollup.select()
+                .where(
+                    (QBStatusRollup.resolution == resolution)
+                    & (QBStatusRollup.bucket_start <= at)
+                )
+                .order_by(QBStatusRollup.bucket_start.desc())
+                .first()
+            )
+            if bucket:
+                return bucket.up_total_last, bucket.dl_total_last
+
+        bucket = QBStatusRollup.select().order_by(QBStatusRollup.bucket_start.asc()).first()
+        if bucket:
+            return bucket.up_total_first, bucket.dl_total_first
+
+        status = QBStatus.select().order_by(QBStatus.created_time.asc()).first()
+        if status:
+            return status.up_total_size, status.dl_total_size
+        return None
+
+    def _watermark(self, model: Type[RollupModel], resolution: int) -> Optional[datetime]:
+        """
+        某个级别已有的最新桶的开始时间
+        """
+        value = (
+            model.select(peewee.fn.MAX(model.bucket_start))
+            .where(model.resolution == resolution)
+            .scalar()
+        )
+        return model.bucket_start.python_value(value)
+
+    def _raw_qb_status_rows(self, start: Optional[datetime]) -> Iterable[dict]:
+        query = QBStatus.select().order_by(QBStatus.created_time.asc())
+        if start:
+            query = query.where(QBStatus.created_time >= start)
+        for row in query.iterator():
+            bucket = self._raw_bucket(
+                row.created_time,
+                row.upspeed,
+                row.dlspeed,
+                row.up_total_size,
+                row.dl_total_size,
+            )
+            bucket["free_space_size"] = row.free_space_size
+            yield bucket
+
+    def _raw_brush_torrent_rows(self, start: Optional[datetime]) -> Iterable[dict]:
+        query = BrushTorrent.select().order_by(BrushTorrent.created_time.asc())
+        if start:
+            query = query.where(BrushTorrent.created_time >= start)
+        for row in query.iterator():
+            bucket = self._raw_bucket(
+                row.created_time,
+                row.upspeed,
+                row.dlspeed,
+                row.up_total_size,
+                row.dl_total_size,
+            )
+            bucket["torrent"] = row.torrent_id
+            yield bucket
+
+    def _raw_bucket(
+        self,
+        created_time: datetime,
+        upspeed: int,
+        dlspeed: int,
+        up_total: int,
+        dl_total: int,
+    ) -> dict:
+        """
+        把一个原始采样转换为只有一个采样的桶
+        """
+        return dict(
+            time=created_time,
+            samples=1,
+            upspeed_min=upspeed,
+            upspeed_max=upspeed,
+            upspeed_avg=upspeed,
+            dlspeed_min=dlspeed,
+            dlspeed_max=dlspeed,
+            dlspeed_avg=dlspeed,
+            up_total_first=up_total,
+            up_total_last=up_total,
+            dl_total_first=dl_total,
+            dl_total_last=dl_total,
+        )
+
+    def _rollup_rows(
+        self, model: Type[RollupModel], resolution: int, start: Optional[datetime]
+    ) -> Iterable[dict]:
+        query = (
+            model.select()
+            .where(model.resolution == resolution)
+            .order_by(model.bucket_start.asc())
+        )
+        if start:
+            query = query.where(model.bucket_start >= start)
+        for row in query.dicts().iterator():
+            for field in ("id", "created_time", "updated_time", "resolution"):
+                row.pop(field)
+            row["time"] = model.bucket_start.python_value(row.pop("bucket_start"))
+            yield row
+
+    def _merge(
+        self, rows: Iterable[dict], resolution: int, keys: Tuple[str, ...]
+    ) -> Dict[tuple, dict]:
+        """
+        按时间顺序把桶合并到 resolution 大小的桶中
+        """
+        buckets: Dict[tuple, dict] = {}
+        for row in rows:
+            bucket_start = self._bucket_start(row.pop("time"), resolution)
+            bucket_key = tuple(row[k] for k in keys) + (bucket_start,)
+            bucket = buckets.get(bucket_key)
+            if bucket is None:
+                buckets[bucket_key] = dict(
+                    row, resolution=resolution, bucket_start=bucket_start
+                )
+                continue
+
+            samples = bucket["samples"] + row["samples"]
+            for field in self.SPEED_FIELDS:
+                bucket[f"{field}_min"] = min(bucket[f"{field}_min"], row[f"{field}_min"])
+                bucket[f"{field}_max"] = max(bucket[f"{field}_max"], row[f"{field}_max"])
+                bucket[f"{field}_avg"] = (
+                    bucket[f"{field}_avg"] * bucket["samples"]
+                    + row[f"{field}_avg"] * row["samples"]
+                ) / samples
+            for field in self.TOTAL_FIELDS:
+                bucket[f"{field}_last"] = row[f"{field}_last"]
+            if "free_space_size" in row:
+                bucket["free_space_size"] = row["free_space_size"]
+            bucket["samples"] = samples
+        return buckets
+
+    def _save(self, model: Type[RollupModel], buckets: Dict[tuple, dict]) -> int:
+        if not buckets:
+            return 0
+        with database.atomic():
+            for chunk in peewee.chunked(list(buckets.values()), 100):
+                model.insert_many(chunk).on_conflict_replace().execute()
+        return len(buckets)
+
+    @staticmethod
+    def _bucket_start(value: datetime, resolution: int) -> datetime:
+        # resolution 均能整除3600，按小时内的偏移对齐即可
+        offset = (value.minute * 60 + value.second) % resolution
+        return value.replace(microsecond=0) - timedelta(seconds=offset)
+
+
 # 刷流逻辑
 class BrushService:
     def __init__(self):
-        self._config = PTBrushConfig()
+        self._config = get_config()
         self._qb = QBittorrent(
             self._config.downloader.url,
             self._config.downloader.username,
             self._config.downloader.password,
         )
+        # 种子文件无法解析、没有预先瘦身就添加的种子数
+        self.unplanned_count = 0
 
     @property
     def last_cycle_max_dlspeed(self) -> int:
@@ -493,13 +954,9 @@ class BrushService:
         start_time = datetime.now() - timedelta(
             seconds=self._config.brush.download_cycle
         )
-        (avg_dlspeed,) = (
-            QBStatus.select(peewee.fn.MAX(QBStatus.dlspeed))
-            .where(QBStatus.created_time > start_time)
-            .scalar(as_tuple=True)
-        )
+        _, max_dlspeed = RollupService().cycle_speed(start_time)
         # 如果还没有采集过qb的信息，那么应该等采集完再决定要不要刷流，因此这里返回最大值
-        return avg_dlspeed if avg_dlspeed != None else 9999999999999
+        return max_dlspeed if max_dlspeed != None else 9999999999999
 
     @property
     def qb_free_space_size(self) -> int:
@@ -514,11 +971,7 @@ class BrushService:
         上一个周期内，qb的平均上传速度
         """
         start_time = datetime.now() - timedelta(seconds=self._config.brush.upload_cycle)
-        (avg_upspeed,) = (
-            QBStatus.select(peewee.fn.AVG(QBStatus.upspeed))
-            .where(QBStatus.created_time > start_time)
-            .scalar(as_tuple=True)
-        )
+        avg_upspeed, _ = RollupService().cycle_speed(start_time)
         # 如果还没有采集过qb的信息，那么应该等采集完再决定要不要刷流，因此这里返回最大值
         return avg_upspeed if avg_upspeed != None else 9999999999999
 
@@ -570,8 +1023,71 @@ class BrushService:
             TorrentDB.site == torrent.site, TorrentDB.torrent_id == torrent.id
         )
         torrent_db.brushed = True
+        # 重新开始刷流，清空上一次刷流留下的状态
+        torrent_db.last_active_at = None
+        torrent_db.last_upspeed = 0
+        torrent_db.last_dlspeed = 0
+        torrent_db.last_up_total = 0
+        torrent_db.last_dl_total = 0
         torrent_db.save()
 
+    def _get_torrent_content(
+        self, torrent: Torrent, site_config: SiteModel
+    ) -> Optional[bytes]:
+        """
+        获取种子文件内容，优先使用本地缓存，未命中时从站点下载并缓存
+        """
+        torrent_content = torrent_cache.get(torrent.site, torrent.id)
+        if torrent_content:
+            logger.info(f"使用本地缓存的种子文件: {torrent.name}")
+            return torrent_content
+
+        torrent_fetch = TorrentFetch.from_config(site_config)
+        torrent_link = torrent_fetch.parse_torrent_link(torrent.id)
+        if not torrent_link:
+            logger.error(f"获取种子下载链接失败，跳过种子{torrent.name}")
+            return None
+        torrent_content = torrent_fetch.download_torrent_content(torrent_link)
+        if not torrent_content:
+            logger.error(f"下载种子内容失败，跳过种子{torrent.name}")
+            return None
+        torrent_cache.put(
+            torrent.site,
+            torrent.id,
+            torrent_content,
+            self._config.brush.torrent_cache_size,
+        )
+        return torrent_content
+
+    def _download_torrent(
+        self, torrent: Torrent, torrent_content: bytes, torrent_rename: str
+    ) -> bool:
+        """
+        添加种子到qb，大包种子在添加前就根据种子文件中的文件列表选好要下载的文件
+        """
+        max_size = self._config.brush.torrent_max_size
+        try:
+            metainfo = parse_metainfo(torrent_content)
+        except BencodeError as e:
+            logger.warning(f"解析种子文件失败，按原样添加种子{torrent.name}: {e}")
+            self.unplanned_count += 1
+            return self._qb.download_torrent_url(torrent_content, torrent_rename)
+
+        if metainfo.size <= max_size:
+            return self._qb.download_torrent_url(torrent_content, torrent_rename)
+
+        skipped, selected_size = plan_skipped_files(metainfo.file_sizes, max_size)
+        total_files = len(metainfo.file_sizes)
+        logger.info(
+            f"大包种子{torrent.name}预先瘦身 - 选择下载: {total_files - len(skipped)}/{total_files}个文件, 预计大小: {selected_size / 1024 / 1024:.2f}MB"
+        )
+        return self._qb.download_torrent_with_skipped_files(
+            torrent_content,
+            torrent_rename,
+            metainfo.infohash,
+            skipped,
+        )
+
     def add_brush_torrent(self, torrents: List[Torrent]):
         for torrent in torrents:
             site_config = self._get_site_config(torrent.site)
@@ -582,27 +1098,21 @@ class BrushService:
             logger.info(
                 f"正在处理种子: {torrent.name} (站点:{torrent.site}, ID:{torrent.id})"
             )
-            torrent_fetch = TorrentFetch(
-                torrent.site, site_config.cookie, site_config.headers
-            )
-            torrent_link = torrent_fetch.parse_torrent_link(torrent.id)
-            if not torrent_link:
-                logger.error(f"获取种子下载链接失败，跳过种子{torrent.name}")
-                continue
             clean_name = torrent.name.split("__meta")[0]
             torrent_rename = f"{clean_name}__meta.{torrent.site}.{torrent.id}.endTime.{torrent.free_end_time.strftime('%Y-%m-%d-%H:%M:%S')}"
-            torrent_content = torrent_fetch.download_torrent_content(torrent_link)
+            torrent_content = self._get_torrent_content(torrent, site_config)
             if not torrent_content:
-                logger.error(f"下载种子内容失败，跳过种子{torrent.name}")
                 continue
 
-            res = self._qb.download_torrent_url(torrent_content, torrent_rename)
+            res = self._download_torrent(torrent, torrent_content, torrent_rename)
             if res:
                 logger.info(
                     f"成功添加种子到QB: {torrent.name} (大小:{torrent.size / 1024 / 1024:.2f}MB)"
                 )
                 self._set_brushed(torrent)
-                SystemMessage.create(
+                record_torrent_event("ADD_TORRENT", torrent.name)
+                db_writer.insert(
+                    SystemMessage,
                     message_type="SUCCESS",
                     category="ADD_TORRENT",
                     content=f"成功添加种子: {torrent.name} ({torrent.site})",
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   torrent_cache.py
+@Time    :   2026/10/18 14:02:31
+@Version :   1.0
+@Desc    :   本地种子文件缓存
+"""
+
+from datetime import datetime
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Optional
+
+from loguru import logger
+
+from db import TorrentFileCache
+
+
+class TorrentCache:
+    """
+    按内容寻址的种子文件缓存
+
+    种子文件以内容的sha1命名存放在 data/torrent_cache 下，数据库中记录
+    (站点, 种子id) -> sha1 的索引以及最后使用时间。总大小超过上限时按最后使用时间
+    从旧到新淘汰，重试添加或重新添加已删除的种子时不再请求站点。
+    """
+
+    def __init__(self, root: Path = Path(__file__).parent / "data" / "torrent_cache"):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def get(self, site: str, torrent_id: str) -> Optional[bytes]:
+        with self._lock:
+            entry = TorrentFileCache.get_or_none(
+                (TorrentFileCache.site == site)
+                & (TorrentFileCache.torrent_id == str(torrent_id))
+            )
+            if entry is None:
+                return None
+            try:
+                content = self._path(entry.sha1).read_bytes()
+            except FileNotFoundError:
+                # 文件被手动删除了，索引也一并删除
+                entry.delete_instance()
+                return None
+            entry.last_used = datetime.now()
+            entry.save()
+            return content
+
+    def put(self, site: str, torrent_id: str, content: bytes, max_size: int):
+        """
+        缓存种子文件，并把缓存总大小控制在 max_size 以内，max_size为0时不缓存
+        """
+        if max_size <= 0 or len(content) > max_size:
+            return
+        sha1 = hashlib.sha1(content).hexdigest()
+        with self._lock:
+            path = self._path(sha1)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(content)
+                os.replace(tmp_path, path)
+
+            now = datetime.now()
+            TorrentFileCache.insert(
+                site=site,
+                torrent_id=str(torrent_id),
+                sha1=sha1,
+                size=len(content),
+                last_used=now,
+            ).on_conflict(
+                conflict_target=[TorrentFileCache.site, TorrentFileCache.torrent_id],
+                update={
+                    TorrentFileCache.sha1: sha1,
+                    TorrentFileCache.size: len(content),
+                    TorrentFileCache.last_used: now,
+                    TorrentFileCache.updated_time: now,
+                },
+            ).execute()
+            self._evict(max_size)
+
+    def _evict(self, max_size: int):
+        # 同一个文件只算一次大小
+        files = TorrentFileCache.select(
+            TorrentFileCache.sha1, TorrentFileCache.size
+        ).distinct()
+        total = sum(size for _, size in files.tuples())
+        if total <= max_size:
+            return
+
+        evicted = 0
+        entries = list(
+            TorrentFileCache.select().order_by(TorrentFileCache.last_used.asc())
+        )
+        for entry in entries:
+            if total <= max_size:
+                break
+            entry.delete_instance()
+            still_used = TorrentFileCache.select().where(
+                TorrentFileCache.sha1 == entry.sha1
+            ).exists()
+            if still_used:
+                continue
+            self._path(entry.sha1).unlink(missing_ok=True)
+            total -= entry.size
+            evicted += 1
+        logger.info(f"种子文件缓存超出上限，已淘汰{evicted}个最久未使用的种子文件")
+
+    def _path(self, sha1: str) -> Path:
+        return self.root / sha1[:2] / f"{sha1}.torrent"
+
+
+torrent_cache = TorrentCache()
@@ -1,19 +1,71 @@
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS
+import gzip
 import os
 from pathlib import Path
 
+from config.config import get_config
+from events import event_broker
+
+# Only text responses are worth compressing, small ones are sent as-is
+GZIP_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+}
+GZIP_MIN_SIZE = 1024
+
+
 def create_app():
-    app = Flask(__name__, 
+    app = Flask(__name__,
                 static_folder='static',
                 template_folder='templates')
     CORS(app)
-    
+
     # Load configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_ptbrush')
-    
+
+    web_config = get_config().web
+    # Cache-Control max-age for bootstrap.min.css / chart.js
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = web_config.static_max_age
+    # Each SSE stream holds a worker thread until the tab is closed
+    event_broker.max_subscribers = web_config.max_streams
+    if web_config.gzip:
+        app.after_request(gzip_response)
+
     # Register blueprints
     from web.routes import main_bp
     app.register_blueprint(main_bp)
-    
-    return app 
\ No newline at end of file
+
+    return app
+
+
+def gzip_response(response):
+    """
+    Compress dynamic text responses when the client accepts gzip
+
+    Static files are sent as a file wrapper and left alone, they are cached
+    by the browser for static_max_age instead of being re-compressed on
+    every request.
+    """
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.mimetype not in GZIP_MIMETYPES
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
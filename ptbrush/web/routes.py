@@ -1,17 +1,64 @@
-from flask import Blueprint, render_template, jsonify, request
-from db import Torrent, BrushTorrent, QBStatus, SystemMessage
+from flask import (
+    Blueprint,
+    Response,
+    render_template,
+    jsonify,
+    make_response,
+    request,
+)
+from db import (
+    Torrent,
+    BrushTorrent,
+    QBStatus,
+    SiteWatermark,
+    SystemMessage,
+    db_writer,
+    log_search_condition,
+)
 from model import Torrent as TorrentModel
 import peewee
 from datetime import datetime, timedelta
 import json
 import re
 import tomlkit
+from functools import wraps
 from loguru import logger
-from config.config import CONFIG_FILE_PATH, PTBrushConfig
+from config.config import CONFIG_FILE_PATH, config_provider, get_config
+from stats import dashboard_stats
+from events import event_broker
 
 main_bp = Blueprint("main", __name__)
 
 
+def conditional(topic):
+    """
+    Answer If-None-Match with 304 using the event broker's version of the topic
+
+    The version is read before the view runs, so a change made while the
+    response is being built only causes one extra full response.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = event_broker.etag(topic)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak, since the body may be gzipped
+            response.set_etag(etag, weak=True)
+            # Let the browser cache it, but always revalidate
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 @main_bp.route("/")
 def dashboard():
     """Dashboard page"""
@@ -32,191 +79,254 @@ def config_page():
 
 @main_bp.route("/api/stats/dashboard")
 @main_bp.route("/api/dashboard/data")
+@conditional("dashboard")
 def get_dashboard_stats():
     """Get statistics for the dashboard"""
     try:
-        # Latest QBStatus
-        latest_status = QBStatus.select().order_by(QBStatus.created_time.desc()).first()
+        # Served from the materialised stats, refreshed by the scheduler jobs
+        return Response(dashboard_stats.payload(), mimetype="application/json")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 
-        # Active Count
-        active_count = len([t for t in Torrent.select().where(Torrent.brushed == True)])
-        if not latest_status:
-            return jsonify(
+@main_bp.route("/api/stats/search")
+def get_search_stats():
+    """Per site / category search depth and candidate yield"""
+    try:
+        marks = SiteWatermark.select().order_by(
+            SiteWatermark.site, SiteWatermark.category
+        )
+        return jsonify(
+            [
                 {
-                    "status": {
-                        "upspeed": 0,
-                        "dlspeed": 0,
-                        "free_space": 0,
-                        "active_count": 0,
-                    },
-                    "period_stats": {},
+                    "site": m.site,
+                    "category": m.category,
+                    "searches": m.searches,
+                    "last_depth": m.last_depth,
+                    "avg_depth": round(m.avg_depth, 2),
+                    "last_items": m.last_items,
+                    "last_candidates": m.last_candidates,
+                    "avg_yield": round(m.avg_yield, 2),
+                    "newest_torrent_id": m.newest_torrent_id,
+                    "newest_created_time": (
+                        m.newest_created_time.strftime("%Y-%m-%d %H:%M:%S")
+                        if m.newest_created_time
+                        else None
+                    ),
+                    "last_full_refresh": (
+                        m.last_full_refresh.strftime("%Y-%m-%d %H:%M:%S")
+                        if m.last_full_refresh
+                        else None
+                    ),
                 }
-            )
-
-        # Period Stats Calculation
-        periods = {"1d": 1, "3d": 3, "7d": 7}
-        period_stats = {}
-        now = datetime.now()
-
-        for p_name, days in periods.items():
-            start_time = now - timedelta(days=days)
-
-            # Count Added/Deleted from SystemMessage
-            added = (
-                SystemMessage.select()
-                .where(
-                    (SystemMessage.created_time >= start_time)
-                    & (SystemMessage.category == "ADD_TORRENT")
-                )
-                .count()
-            )
+                for m in marks
+            ]
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            deleted = (
-                SystemMessage.select()
-                .where(
-                    (SystemMessage.created_time >= start_time)
-                    & (SystemMessage.category == "DELETE_TORRENT")
-                )
-                .count()
-            )
 
-            # Traffic
-            # Find closest status records to start_time
-            # We need status at start_time.
-            past_status = (
-                QBStatus.select()
-                .where(QBStatus.created_time <= start_time)
-                .order_by(QBStatus.created_time.desc())
-                .first()
-            )
-            # If no record before start_time, take the earliest we have
-            if not past_status:
-                past_status = (
-                    QBStatus.select().order_by(QBStatus.created_time.asc()).first()
-                )
-
-            up_traffic = 0
-            dl_traffic = 0
-            if past_status:
-                up_traffic = max(
-                    0, latest_status.up_total_size - past_status.up_total_size
-                )
-                dl_traffic = max(
-                    0, latest_status.dl_total_size - past_status.dl_total_size
-                )
-
-            period_stats[p_name] = {
-                "added_count": added,
-                "deleted_count": deleted,
-                "upload_traffic": up_traffic,
-                "download_traffic": dl_traffic,
-            }
+@main_bp.route("/api/stats/db-writer")
+def get_db_writer_stats():
+    """Write queue depth and how many rows were written or dropped"""
+    return jsonify(db_writer.stats)
+
+
+def state_torrents_data() -> dict:
+    """Active torrents with their latest sample, in a single query"""
+    # Get all active torrents (brushed=True), sorted by deletion priority (Score ASC, Oldest First)
+    # This matches the logic in services.check_disk_space_and_cleanup
+    # Latest speed info is maintained on the torrent row by the qb fetcher
+    active_torrents = (
+        Torrent.select(
+            Torrent.name,
+            Torrent.site,
+            Torrent.size,
+            Torrent.last_upspeed,
+            Torrent.last_dlspeed,
+            Torrent.last_up_total,
+            Torrent.last_dl_total,
+            Torrent.free_end_time,
+            Torrent.score,
+        )
+        .where(Torrent.brushed == True)
+        .order_by(Torrent.score.asc(), Torrent.created_time.asc())
+    )
 
-        return jsonify(
+    torrents_data = []
+    for t in active_torrents:
+        torrents_data.append(
             {
-                "status": {
-                    "upspeed": latest_status.upspeed,
-                    "dlspeed": latest_status.dlspeed,
-                    "free_space": latest_status.free_space_size,
-                    "active_count": active_count,
-                    "timestamp": latest_status.created_time.strftime(
-                        "%Y-%m-%d %H:%M:%S"
-                    ),
-                },
-                "period_stats": period_stats,
+                "hash": "",  # No hash in DB, use name as key
+                "name": t.name,
+                "site": t.site,
+                "size": t.size,
+                "upspeed": t.last_upspeed,
+                "dlspeed": t.last_dlspeed,
+                "up_total": t.last_up_total,
+                "dl_total": t.last_dl_total,
+                "free_end_time": t.free_end_time.strftime("%Y-%m-%d %H:%M:%S"),
+                "score": t.score,
             }
         )
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+    # Calculate Candidates
+    # Since the list is already sorted by priority (Lowest Score First),
+    # the first few items are the candidates for deletion.
+    candidates = [t["name"] for t in torrents_data[:5]]
+
+    config = get_config()
+    return {
+        "torrents": torrents_data,
+        "candidates": candidates,
+        "max_active": config.brush.max_active_torrents,
+    }
 
 
 @main_bp.route("/api/state/torrents")
+@conditional("torrents")
 def get_state_torrents():
     """Get active torrents and candidates"""
     try:
-        # Get all active torrents (brushed=True), sorted by deletion priority (Score ASC, Oldest First)
-        # This matches the logic in services.check_disk_space_and_cleanup
-        active_torrents = (
-            Torrent.select()
-            .where(Torrent.brushed == True)
-            .order_by(Torrent.score.asc(), Torrent.created_time.asc())
-        )
+        return jsonify(state_torrents_data())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        torrents_data = []
-        for t in active_torrents:
-            # Get latest speed info for this torrent
-            bt = (
-                BrushTorrent.select()
-                .where(BrushTorrent.torrent == t)
-                .order_by(BrushTorrent.created_time.desc())
-                .first()
-            )
 
-            upspeed = bt.upspeed if bt else 0
-            dlspeed = bt.dlspeed if bt else 0
-            up_total = bt.up_total_size if bt else 0
-            dl_total = bt.dl_total_size if bt else 0
+event_broker.register("torrents", state_torrents_data)
+
+
+@main_bp.route("/api/events")
+def get_events():
+    """
+    Server-Sent Events stream of dashboard, torrents and logs updates
+
+    Every open stream holds a worker thread. Past the subscriber cap the
+    stream is refused and the page falls back to ETag polling.
+    """
+    topics = request.args.get("topics", "dashboard,torrents,logs").split(",")
+    stream = event_broker.open_stream(topics)
+    if stream is None:
+        return jsonify({"error": "Too many event streams, poll instead"}), 503
+    # Not wrapped in stream_with_context, so the server's close() reaches the
+    # stream and unsubscribes it even if it was never iterated
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+LOG_PAGE_SIZE = 100
+LOG_MAX_PAGE_SIZE = 500
+
+
+def log_to_dict(msg) -> dict:
+    return {
+        "id": msg.id,
+        "time": msg.created_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "type": msg.message_type,
+        "category": msg.category,
+        "content": msg.content,
+    }
+
+
+def parse_log_cursor(cursor: str):
+    """Cursor is "<created_time isoformat>,<id>" of the last row of the previous page"""
+    created_time, _, msg_id = cursor.rpartition(",")
+    return datetime.fromisoformat(created_time), int(msg_id)
+
+
+def query_logs(
+    filter_level="",
+    category="",
+    keyword="",
+    since=None,
+    until=None,
+    cursor=None,
+    limit=LOG_PAGE_SIZE,
+):
+    """
+    Newest first, keyset paginated on (created_time, id)
+
+    Returns the rows of the page and the cursor of the next one (None on the
+    last page). Every filter combination is served by one of the
+    SystemMessage indexes, so deep pages cost the same as the first one.
+    """
+    query = SystemMessage.select().order_by(
+        SystemMessage.created_time.desc(), SystemMessage.id.desc()
+    )
+    if filter_level == "DELETE_TORRENT":
+        # Kept for the state page's filter select
+        category = "DELETE_TORRENT"
+    elif filter_level:
+        query = query.where(SystemMessage.message_type == filter_level)
+    if category:
+        query = query.where(SystemMessage.category == category)
+    if keyword:
+        query = query.where(log_search_condition(keyword))
+    if since:
+        query = query.where(SystemMessage.created_time >= since)
+    if until:
+        query = query.where(SystemMessage.created_time < until)
+    if cursor:
+        cursor_time, cursor_id = cursor
+        query = query.where(
+            (SystemMessage.created_time < cursor_time)
+            | ((SystemMessage.created_time == cursor_time) & (SystemMessage.id < cursor_id))
+        )
 
-            torrents_data.append(
-                {
-                    "hash": "",  # No hash in DB, use name as key
-                    "name": t.name,
-                    "site": t.site,
-                    "size": t.size,
-                    "upspeed": upspeed,
-                    "dlspeed": dlspeed,
-                    "up_total": up_total,
-                    "dl_total": dl_total,
-                    "free_end_time": t.free_end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "score": t.score,
-                }
-            )
+    # One extra row tells whether there is a next page
+    rows = list(query.limit(limit + 1))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last.created_time.isoformat()},{last.id}"
+    return rows, next_cursor
 
-        # Calculate Candidates
-        # Since the list is already sorted by priority (Lowest Score First),
-        # the first few items are the candidates for deletion.
-        candidates = [t["name"] for t in torrents_data[:5]]
 
-        config = PTBrushConfig()
-        return jsonify(
-            {
-                "torrents": torrents_data,
-                "candidates": candidates,
-                "max_active": config.brush.max_active_torrents,
-            }
-        )
+@main_bp.route("/api/state/logs")
+@conditional("logs")
+def get_logs():
+    filter_level = request.args.get("filter", "")
+    try:
+        rows, _ = query_logs(filter_level=filter_level)
+        return jsonify([log_to_dict(msg) for msg in rows])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@main_bp.route("/api/state/logs")
-def get_logs():
-    filter_level = request.args.get("filter", "")
+@main_bp.route("/api/logs")
+def browse_logs():
+    """
+    Paginated log browsing
+
+    Query parameters: filter / type, category, q (full-text), since, until
+    (ISO datetimes), cursor (next_cursor of the previous page) and limit.
+    """
     try:
-        query = (
-            SystemMessage.select()
-            .order_by(SystemMessage.created_time.desc())
-            .limit(100)
+        args = request.args
+        limit = min(max(args.get("limit", LOG_PAGE_SIZE, type=int), 1), LOG_MAX_PAGE_SIZE)
+        since = args.get("since")
+        until = args.get("until")
+        cursor = args.get("cursor")
+        rows, next_cursor = query_logs(
+            filter_level=args.get("filter") or args.get("type", ""),
+            category=args.get("category", ""),
+            keyword=args.get("q", "").strip(),
+            since=datetime.fromisoformat(since) if since else None,
+            until=datetime.fromisoformat(until) if until else None,
+            cursor=parse_log_cursor(cursor) if cursor else None,
+            limit=limit,
         )
-        if filter_level:
-            if filter_level == "DELETE_TORRENT":
-                query = query.where(SystemMessage.category == "DELETE_TORRENT")
-            else:
-                query = query.where(SystemMessage.message_type == filter_level)
-
-        logs = []
-        for msg in query:
-            logs.append(
-                {
-                    "time": msg.created_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "type": msg.message_type,
-                    "category": msg.category,
-                    "content": msg.content,
-                }
-            )
-        return jsonify(logs)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    return jsonify(
+        {"logs": [log_to_dict(msg) for msg in rows], "next_cursor": next_cursor}
+    )
 
 
 @main_bp.route("/api/logs/clear", methods=["POST"])
@@ -236,11 +346,8 @@ def clear_logs():
 
 @main_bp.route("/api/config")
 def get_config_json():
-    # Existing implementation adapted
-    from config.config import PTBrushConfig
-
     try:
-        config = PTBrushConfig()
+        config = get_config()
         return jsonify(
             {
                 "brush": {
@@ -348,6 +455,9 @@ def save_config_raw():
         # Write to file
         with open(CONFIG_FILE_PATH, "w", encoding="utf-8") as f:
             f.write(new_doc.as_string())
+        config_provider.invalidate()
+        # max_active_torrents is part of the torrents payload
+        event_broker.notify("torrents")
 
         return jsonify({"status": "success"})
 
@@ -387,6 +497,8 @@ def config_update_gui():
             content = replace_toml_key(content, cw_key, cw_val)
 
         CONFIG_FILE_PATH.write_text(content, encoding="utf-8")
+        config_provider.invalidate()
+        event_broker.notify("torrents")
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
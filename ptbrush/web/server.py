@@ -8,13 +8,41 @@
 
 # here put the import lib
 
+from loguru import logger
+from config.config import get_config
 from web import create_app
 import threading
 
 def run_web_server(host='0.0.0.0', port=8000, debug=False):
     """在单独的线程中运行 web 服务器"""
     app = create_app()
-    app.run(host=host, port=port, debug=debug, use_reloader=False)
+    web_config = get_config().web
+    if web_config.server == "production":
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("未安装waitress，无法使用production模式，改为使用Flask开发服务器")
+        else:
+            # 实时推送连接会一直占用线程，为它们额外预留线程，
+            # threads 个线程始终留给页面和接口请求
+            threads = web_config.threads + web_config.max_streams
+            logger.info(
+                f"使用waitress提供web服务，工作线程数: {threads} "
+                f"(其中{web_config.max_streams}个供实时推送使用)"
+            )
+            serve(
+                app,
+                host=host,
+                port=port,
+                threads=threads,
+                connection_limit=web_config.connection_limit,
+                channel_timeout=web_config.channel_timeout,
+                # 实时推送的事件很小，不等待凑满发送缓冲区
+                send_bytes=1,
+                ident="ptbrush",
+            )
+            return
+    app.run(host=host, port=port, debug=debug, use_reloader=False, threaded=True)
 
 def start_web_server_thread(host='0.0.0.0', port=8000):
     """在后台线程中启动 web 服务器"""
@@ -24,4 +52,4 @@ def start_web_server_thread(host='0.0.0.0', port=8000):
         daemon=True
     )
     web_thread.start()
-    return web_thread 
\ No newline at end of file
+    return web_thread
@@ -0,0 +1,23 @@
+import sys
+
+import pytest
+from loguru import logger
+
+import db
+
+
+@pytest.fixture(autouse=True, scope="session")
+def isolate_logging():
+    """main adds file and database log sinks on import, keep test runs out of data/"""
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Point the shared database at a fresh temporary SQLite file"""
+    db.database.close()
+    db.database.init(str(tmp_path / "ptbrush.db"), pragmas=db.database._pragmas)
+    db.migrate_database()
+    yield db.database
+    db.database.close()
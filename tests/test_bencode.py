@@ -0,0 +1,70 @@
+import hashlib
+
+import pytest
+
+from bencode import (
+    BencodeError,
+    decode,
+    encode,
+    info_span,
+    parse_metainfo,
+    plan_skipped_files,
+)
+
+
+def test_round_trip():
+    obj = {b"a": [1, -2, b"xy"], b"b": {b"c": b""}, b"n": 0}
+    data = encode(obj)
+    assert data == b"d1:ali1ei-2e2:xye1:bd1:c0:e1:ni0ee"
+    assert decode(data) == obj
+    # str keys and values are encoded as utf-8
+    assert encode({"k": "v"}) == b"d1:k1:ve"
+
+
+@pytest.mark.parametrize("data", [b"", b"i1", b"5:ab", b"l", b"di1ei2ee", b"i1ei2e", b"x"])
+def test_decode_invalid(data):
+    with pytest.raises(BencodeError):
+        decode(data)
+
+
+def test_infohash_uses_raw_bytes():
+    # Keys of the info dict are not sorted, re-encoding would change the hash
+    info = b"d4:name1:a6:lengthi5ee"
+    content = b"d8:announce3:url4:info" + info + b"e"
+    start, end = info_span(content)
+    assert content[start:end] == info
+
+    metainfo = parse_metainfo(content)
+    assert metainfo.infohash == hashlib.sha1(info).hexdigest()
+    assert metainfo.name == "a"
+    assert metainfo.file_sizes == [5]
+
+
+def test_parse_multi_file_skips_pad_files():
+    content = encode(
+        {
+            "info": {
+                "name": "dir",
+                "files": [
+                    {"length": 10, "path": ["a"]},
+                    {"length": 6, "path": [".pad", "6"], "attr": "p"},
+                    {"length": 20, "path": ["b"]},
+                ],
+            }
+        }
+    )
+    metainfo = parse_metainfo(content)
+    assert metainfo.file_sizes == [10, 20]
+    assert metainfo.size == 30
+
+
+def test_parse_v2_only():
+    with pytest.raises(BencodeError):
+        parse_metainfo(encode({"info": {"name": "a", "file tree": {}}}))
+
+
+def test_plan_skipped_files():
+    assert plan_skipped_files([10, 20, 30], 60) == ([], 60)
+    assert plan_skipped_files([10, 20, 30], 50) == ([0], 50)
+    assert plan_skipped_files([10, 20, 30], 30) == ([0, 1], 30)
+    assert plan_skipped_files([100], 50) == ([0], 0)
@@ -0,0 +1,55 @@
+import peewee
+
+from db import BatchWriter, QBStatus, SystemMessage
+
+
+def _writer(fail_times, error="database is locked"):
+    writer = BatchWriter(max_retries=3, retry_backoff=0, max_backoff=0)
+    write = writer._write
+    calls = []
+
+    def flaky_write(items):
+        calls.append(len(items))
+        if len(calls) <= fail_times:
+            raise peewee.OperationalError(error)
+        write(items)
+
+    writer._write = flaky_write
+    return writer, calls
+
+
+def _status_row():
+    return QBStatus, dict(upspeed=1, dlspeed=2, up_total_size=3, dl_total_size=4), False
+
+
+def _log_row(content="log"):
+    return SystemMessage, dict(message_type="INFO", category="SYSTEM", content=content), True
+
+
+def test_retry_locked_batch(temp_db):
+    writer, calls = _writer(fail_times=2)
+    items = [_status_row(), _log_row()]
+    assert writer._write_with_retry(items) == items
+    assert calls == [2, 2, 2]
+    assert QBStatus.select().count() == 1
+    assert SystemMessage.select().where(SystemMessage.content == "log").count() == 1
+    assert writer.dropped_total == 0
+
+
+def test_give_up_on_logs_only(temp_db):
+    writer, calls = _writer(fail_times=4)
+    written = writer._write_with_retry([_log_row(), _status_row(), _log_row()])
+    # Log rows are dropped after max_retries, samples are retried until written
+    assert [model for model, _, _ in written] == [QBStatus]
+    assert calls == [3, 3, 3, 1, 1]
+    assert QBStatus.select().count() == 1
+    assert SystemMessage.select().where(SystemMessage.content == "log").count() == 0
+    assert writer.dropped_total == 2
+
+
+def test_non_transient_error_isolates_bad_rows(temp_db):
+    writer = BatchWriter()
+    bad = (QBStatus, dict(no_such_column=1), False)
+    written = writer._write_with_retry([_status_row(), bad, _log_row()])
+    assert [model for model, _, _ in written] == [QBStatus, SystemMessage]
+    assert QBStatus.select().count() == 1
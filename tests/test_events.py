@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from events import event_broker
+
+
+@pytest.fixture
+def app(temp_db, monkeypatch):
+    from web import create_app
+
+    app = create_app()
+    monkeypatch.setattr(event_broker, "max_subscribers", 2)
+    monkeypatch.setattr(event_broker, "HEARTBEAT_INTERVAL", 0.1)
+    yield app
+    assert event_broker.subscriber_count == 0
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_stream_cap_and_unsubscribe_without_iterating(app):
+    client = app.test_client()
+    streams = [client.get("/api/events?topics=logs", buffered=False) for _ in range(2)]
+    assert [r.status_code for r in streams] == [200, 200]
+    assert event_broker.subscriber_count == 2
+
+    refused = client.get("/api/events?topics=logs")
+    assert refused.status_code == 503
+
+    # The server closes the response even if the client never read it
+    streams[0].close()
+    assert event_broker.subscriber_count == 1
+    reopened = client.get("/api/events?topics=logs", buffered=False)
+    assert reopened.status_code == 200
+    for response in (streams[1], reopened):
+        response.close()
+
+
+def test_streams_past_cap_do_not_starve_workers(app):
+    waitress = pytest.importorskip("waitress.server")
+    server = waitress.create_server(app, host="127.0.0.1", port=0, threads=4)
+    port = server.effective_port
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{port}"
+    streams = []
+    try:
+        for _ in range(6):
+            streams.append(
+                requests.get(f"{base}/api/events?topics=logs", stream=True, timeout=5)
+            )
+        statuses = [r.status_code for r in streams]
+        assert statuses.count(200) == 2
+        assert statuses.count(503) == 4
+
+        for _ in range(3):
+            assert requests.get(f"{base}/api/state/logs", timeout=5).status_code == 200
+    finally:
+        for response in streams:
+            response.close()
+        # Disconnects are noticed on the next heartbeat write
+        assert _wait_for(lambda: event_broker.subscriber_count == 0)
+        server.close()
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from ptsite.extract import Extractor, Field, FieldPath
+from ptsite.mteam import MTeamSpider
+
+
+def test_field_path():
+    item = {"status": {"mallSingleFree": {"status": "ONGOING"}, "seeders": 0}}
+    assert FieldPath("status.mallSingleFree.status")(item) == "ONGOING"
+    assert FieldPath("$.status.seeders")(item) == 0
+    assert FieldPath("status.discount")(item) is None
+    # Intermediate values that are missing or not objects
+    assert FieldPath("status.seeders.value")(item) is None
+    assert FieldPath("name.first")({}) is None
+
+
+def test_field_fallback_and_convert():
+    field = Field("a", "b", convert=int, default=-1)
+    assert field({"a": "1", "b": "2"}) == 1
+    assert field({"a": "", "b": "2"}) == 2
+    assert field({"a": None}) == -1
+
+
+def test_extractor():
+    extract = Extractor(name="name", size=Field("size", convert=int))
+    assert extract({"name": "a", "size": "10"}) == {"name": "a", "size": 10}
+
+
+def test_mteam_fields():
+    item = {
+        "id": "1",
+        "name": "t",
+        "size": "1024",
+        "createdDate": "2026-10-01 12:00:00",
+        "status": {
+            "seeders": 3,
+            "leechers": 5,
+            "discount": "NORMAL",
+            "discountEndTime": None,
+            "mallSingleFree": {"status": "ONGOING", "endDate": "2026-10-02 12:00:00"},
+        },
+    }
+    fields = MTeamSpider.FIELDS(item)
+    assert fields["size"] == 1024
+    assert fields["created_time"] == datetime(2026, 10, 1, 12)
+    assert fields["free_end_time"] == datetime(2026, 10, 2, 12)
+    assert fields["mall_single_free_status"] == "ONGOING"
@@ -0,0 +1,102 @@
+import pytest
+
+from qbittorrent import QBSyncEngine
+
+
+class StubClient:
+    """Returns canned sync/maindata responses and records the requested rid"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.rids = []
+
+    def sync_maindata(self, rid=0):
+        self.rids.append(rid)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_full_partial_empty_sequence():
+    client = StubClient(
+        {
+            "rid": 1,
+            "full_update": True,
+            "torrents": {
+                "a": {"name": "A", "category": "ptbrush", "upspeed": 1},
+                "b": {"name": "B", "category": "ptbrush", "upspeed": 2},
+                "c": {"name": "C", "category": "other"},
+            },
+            "server_state": {"alltime_ul": 10, "free_space_on_disk": 100},
+        },
+        {
+            "rid": 2,
+            "torrents": {"a": {"upspeed": 5}},
+            "torrents_removed": ["b"],
+            "server_state": {"alltime_ul": 20},
+        },
+        {"rid": 3},
+    )
+    engine = QBSyncEngine()
+
+    engine.sync(client)
+    assert sorted(t["hash"] for t in engine.torrents("ptbrush")) == ["a", "b"]
+
+    engine.sync(client)
+    torrents = engine.torrents("ptbrush")
+    # Partial updates only carry changed fields
+    assert torrents == [{"hash": "a", "name": "A", "category": "ptbrush", "upspeed": 5}]
+    assert engine.server_state == {"alltime_ul": 20, "free_space_on_disk": 100}
+
+    engine.sync(client)
+    assert engine.torrents("ptbrush") == torrents
+    assert engine.server_state == {"alltime_ul": 20, "free_space_on_disk": 100}
+    assert client.rids == [0, 1, 2]
+    assert engine.rid == 3
+
+
+def test_full_update_resets_state():
+    client = StubClient(
+        {
+            "rid": 1,
+            "full_update": True,
+            "torrents": {"a": {"name": "A", "category": "ptbrush"}},
+            "server_state": {"alltime_ul": 10, "dl_info_speed": 3},
+        },
+        {
+            "rid": 1,
+            "full_update": True,
+            "torrents": {"b": {"name": "B", "category": "ptbrush"}},
+            "server_state": {"alltime_ul": 1},
+        },
+    )
+    engine = QBSyncEngine()
+    engine.sync(client)
+    engine.sync(client)
+    assert engine.torrents("ptbrush") == [{"hash": "b", "name": "B", "category": "ptbrush"}]
+    assert engine.server_state == {"alltime_ul": 1}
+
+
+def test_failed_request_resyncs_from_zero():
+    client = StubClient(
+        {"rid": 4, "full_update": True, "torrents": {}},
+        ConnectionError("qb down"),
+        {"rid": 1, "full_update": True, "torrents": {}},
+    )
+    engine = QBSyncEngine()
+    engine.sync(client)
+    with pytest.raises(ConnectionError):
+        engine.sync(client)
+    engine.sync(client)
+    assert client.rids == [0, 4, 0]
+
+
+def test_returned_torrents_are_copies():
+    client = StubClient(
+        {"rid": 1, "full_update": True, "torrents": {"a": {"category": "ptbrush"}}}
+    )
+    engine = QBSyncEngine()
+    engine.sync(client)
+    engine.torrents("ptbrush")[0]["category"] = "changed"
+    assert engine.torrents("ptbrush")[0]["category"] == "ptbrush"
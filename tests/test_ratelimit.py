@@ -0,0 +1,65 @@
+import pytest
+from ptsite import TokenBucket, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=0.5, burst=3, clock=clock, sleep=clock.sleep)
+
+    # The initial burst goes out without waiting
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    # Then one request every 2 seconds
+    assert bucket.acquire() == pytest.approx(2)
+    assert bucket.acquire() == pytest.approx(2)
+    assert clock.now == pytest.approx(4)
+
+
+def test_token_bucket_refill_is_capped(clock):
+    bucket = TokenBucket(rate=1, burst=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 100
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1)
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(rate=1, burst=5, clock=clock, sleep=clock.sleep)
+    bucket.pause(30)
+
+    # Retry-After holds every request, then only one goes out
+    assert bucket.acquire() == pytest.approx(30)
+    assert bucket.acquire() == pytest.approx(1)
+    assert clock.now == pytest.approx(31)
+
+
+def test_token_bucket_configure(clock):
+    bucket = TokenBucket(rate=1, burst=5, clock=clock, sleep=clock.sleep)
+    bucket.configure(rate=0.1, burst=1)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(10)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    # HTTP dates in the past mean retry now
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from db import BrushTorrent, BrushTorrentRollup, QBStatus, QBStatusRollup, Torrent
+from tasks.services import RollupService
+
+BASE = datetime(2024, 1, 1, 10, 0, 0)
+
+
+def _status(at, upspeed=0, dlspeed=0, up_total=0, dl_total=0):
+    QBStatus.create(
+        created_time=at,
+        upspeed=upspeed,
+        dlspeed=dlspeed,
+        up_total_size=up_total,
+        dl_total_size=dl_total,
+    )
+
+
+def _buckets(resolution):
+    return list(
+        QBStatusRollup.select()
+        .where(QBStatusRollup.resolution == resolution)
+        .order_by(QBStatusRollup.bucket_start)
+    )
+
+
+def test_rollup_levels(temp_db):
+    _status(BASE + timedelta(seconds=10), upspeed=100, dlspeed=5, up_total=1000)
+    _status(BASE + timedelta(seconds=20), upspeed=300, dlspeed=1, up_total=1200)
+    _status(BASE + timedelta(seconds=70), upspeed=50, dlspeed=9, up_total=1500)
+    RollupService().rollup()
+
+    first, second = _buckets(60)
+    assert first.bucket_start == BASE
+    assert (first.samples, first.upspeed_min, first.upspeed_max) == (2, 100, 300)
+    assert first.upspeed_avg == 200
+    assert (first.up_total_first, first.up_total_last) == (1000, 1200)
+    assert second.bucket_start == BASE + timedelta(seconds=60)
+
+    (quarter,) = _buckets(900)
+    assert (quarter.samples, quarter.dlspeed_max) == (3, 9)
+    assert quarter.upspeed_avg == pytest.approx(150)
+    assert (quarter.up_total_first, quarter.up_total_last) == (1000, 1500)
+    (hour,) = _buckets(3600)
+    assert hour.samples == 3
+
+
+def test_rollup_recomputes_latest_bucket_idempotently(temp_db):
+    service = RollupService()
+    _status(BASE + timedelta(seconds=10), upspeed=100)
+    _status(BASE + timedelta(seconds=70), upspeed=200)
+    service.rollup()
+    service.rollup()
+    assert [b.samples for b in _buckets(60)] == [1, 1]
+    assert _buckets(900)[0].samples == 2
+
+    # A late sample in the newest bucket completes it on the next run
+    _status(BASE + timedelta(seconds=80), upspeed=400)
+    service.rollup()
+    first, second = _buckets(60)
+    assert (first.samples, second.samples) == (1, 2)
+    assert second.upspeed_avg == 300
+    (quarter,) = _buckets(900)
+    assert quarter.samples == 3
+    assert quarter.upspeed_avg == pytest.approx(700 / 3)
+    assert QBStatusRollup.select().count() == 4
+
+
+def test_rollup_brush_torrents_per_torrent(temp_db):
+    torrents = [
+        Torrent.create(name=f"t{i}", site="s", torrent_id=str(i), free_end_time=BASE)
+        for i in range(2)
+    ]
+    for i, torrent in enumerate(torrents):
+        for seconds in (5, 15):
+            BrushTorrent.create(
+                torrent=torrent,
+                created_time=BASE + timedelta(seconds=seconds),
+                upspeed=(i + 1) * seconds,
+            )
+    RollupService().rollup()
+    buckets = list(
+        BrushTorrentRollup.select()
+        .where(BrushTorrentRollup.resolution == 60)
+        .order_by(BrushTorrentRollup.torrent)
+    )
+    assert [(b.torrent_id, b.samples, b.upspeed_max) for b in buckets] == [
+        (torrents[0].id, 2, 15),
+        (torrents[1].id, 2, 30),
+    ]
+
+
+def test_prune_keeps_raw_rows_until_rolled_up(temp_db):
+    service = RollupService()
+    now = datetime.now()
+    _status(now - timedelta(days=8))
+    _status(now - timedelta(days=2))
+
+    service.prune()
+    assert QBStatus.select().count() == 2
+
+    _status(now - timedelta(minutes=1))
+    service.rollup()
+    service.prune()
+    assert [s.created_time for s in QBStatus.select()] == [now - timedelta(minutes=1)]
+    # Minute buckets expire after 7 days, coarser levels are kept longer
+    assert len(_buckets(60)) == 2
+    assert len(_buckets(900)) == 3
+
+
+def test_cycle_speed_combines_buckets_and_raw_tail(temp_db):
+    service = RollupService()
+    assert service.cycle_speed(BASE) == (None, None)
+
+    _status(BASE + timedelta(seconds=10), upspeed=100, dlspeed=7)
+    _status(BASE + timedelta(seconds=20), upspeed=200, dlspeed=3)
+    service.rollup()
+    # Not rolled up yet
+    _status(BASE + timedelta(seconds=90), upspeed=600, dlspeed=1)
+
+    assert service.cycle_speed(BASE) == (300, 7)
+    assert service.cycle_speed(BASE + timedelta(seconds=60)) == (600, 1)
+
+
+def _raw_speed(start_time):
+    rows = [s for s in QBStatus.select() if s.created_time >= start_time]
+    return sum(s.upspeed for s in rows) / len(rows), max(s.dlspeed for s in rows)
+
+
+def test_cycle_speed_matches_raw_samples(temp_db):
+    service = RollupService()
+    for seconds, upspeed, dlspeed in [
+        (10, 100, 9),
+        (20, 200, 2),
+        (70, 300, 3),
+        (80, 500, 4),
+        (130, 700, 1),
+        (200, 900, 2),
+    ]:
+        _status(BASE + timedelta(seconds=seconds), upspeed=upspeed, dlspeed=dlspeed)
+    service.rollup()
+    # Late samples in the newest bucket and after it
+    _status(BASE + timedelta(seconds=190), upspeed=1000, dlspeed=8)
+    _status(BASE + timedelta(seconds=250), upspeed=50, dlspeed=1)
+
+    # Window starts inside a bucket, on a boundary, and inside the newest bucket
+    for seconds in (15, 60, 75, 185):
+        start_time = BASE + timedelta(seconds=seconds)
+        upspeed, dlspeed = service.cycle_speed(start_time)
+        expected_upspeed, expected_dlspeed = _raw_speed(start_time)
+        assert upspeed == pytest.approx(expected_upspeed)
+        assert dlspeed == expected_dlspeed
+
+
+def test_qb_totals_at(temp_db):
+    service = RollupService()
+    assert service.qb_totals_at(BASE) is None
+
+    _status(BASE + timedelta(seconds=10), up_total=100, dl_total=10)
+    assert service.qb_totals_at(BASE) == (100, 10)
+
+    _status(BASE + timedelta(seconds=70), up_total=300, dl_total=30)
+    service.rollup()
+    assert service.qb_totals_at(BASE + timedelta(seconds=65)) == (300, 30)
+    assert service.qb_totals_at(BASE + timedelta(seconds=30)) == (100, 10)
+    # Before the first bucket
+    assert service.qb_totals_at(BASE - timedelta(hours=1)) == (100, 10)
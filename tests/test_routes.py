@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from db import SystemMessage, db_writer
+
+
+@pytest.fixture
+def client(temp_db):
+    from web import create_app
+
+    return create_app().test_client()
+
+
+def test_db_writer_stats(client):
+    data = client.get("/api/stats/db-writer").get_json()
+    assert data == db_writer.stats
+    assert set(data) == {"queued", "capacity", "written", "dropped"}
+
+
+def _add_logs(rows):
+    SystemMessage.insert_many(rows).execute()
+
+
+def test_log_pages_with_tied_timestamps(client):
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    # 5 distinct timestamps with 5 rows each
+    _add_logs(
+        [
+            dict(
+                message_type="INFO",
+                category="SYSTEM",
+                content=f"log {i}",
+                created_time=base + timedelta(seconds=i // 5),
+            )
+            for i in range(25)
+        ]
+    )
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 10}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/api/logs", query_string=params).get_json()
+        seen.extend(data["logs"])
+        pages += 1
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == 3
+    ids = [log["id"] for log in seen]
+    assert len(ids) == len(set(ids)) == 25
+    keys = [(log["time"], log["id"]) for log in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_log_filters(client, monkeypatch, fts):
+    if fts:
+        assert db.log_fts_available
+    else:
+        monkeypatch.setattr(db, "log_fts_available", False)
+    _add_logs(
+        [
+            dict(message_type=t, category=c, content=content, created_time=datetime(2024, 1, day))
+            for day, t, c, content in [
+                (1, "INFO", "SYSTEM", "抓取种子完成"),
+                (2, "ERROR", "SYSTEM", "下载种子失败"),
+                (3, "SUCCESS", "DELETE_TORRENT", "删除种子: abc"),
+            ]
+        ]
+    )
+
+    def contents(**params):
+        data = client.get("/api/logs", query_string=params).get_json()
+        return [log["content"] for log in data["logs"]]
+
+    assert contents(type="ERROR") == ["下载种子失败"]
+    assert contents(filter="DELETE_TORRENT") == ["删除种子: abc"]
+    assert contents(since="2024-01-02T00:00:00") == ["删除种子: abc", "下载种子失败"]
+    assert contents(until="2024-01-02T00:00:00") == ["抓取种子完成"]
+    # With FTS, 3+ characters use the trigram index and shorter keywords use LIKE
+    assert contents(q="下载种子") == ["下载种子失败"]
+    assert contents(q="abc") == ["删除种子: abc"]
+    assert contents(q="种子") == ["删除种子: abc", "下载种子失败", "抓取种子完成"]
+    assert contents(q="不存在的内容") == []
+
+
+def test_log_bad_parameters(client):
+    assert client.get("/api/logs?cursor=nonsense").status_code == 400
+    assert client.get("/api/logs?cursor=2024-01-01T00:00:00,x").status_code == 400
+    assert client.get("/api/logs?since=yesterday").status_code == 400
+
+
+def _revalidate(client, url, etag):
+    return client.get(url, headers={"If-None-Match": etag})
+
+
+def test_conditional_get(client):
+    response = client.get("/api/state/logs")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"logs-')
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = _revalidate(client, "/api/state/logs", etag)
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    # Other topics have their own versions
+    other = client.get("/api/state/torrents").headers["ETag"]
+    assert other != etag
+    assert _revalidate(client, "/api/state/logs", other).status_code == 200
+
+
+def test_etag_changes_after_log_write(client):
+    from events import _publish_new_logs
+
+    etag = client.get("/api/state/logs").headers["ETag"]
+    row = dict(
+        message_type="INFO", category="SYSTEM", content="new", created_time=datetime.now()
+    )
+    SystemMessage.insert(**row).execute()
+    # Called by the database writer after the batch is committed
+    _publish_new_logs([(SystemMessage, row)])
+
+    response = _revalidate(client, "/api/state/logs", etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()[0]["content"] == "new"
+
+
+def test_etag_changes_after_clear_logs(client, tmp_path, monkeypatch):
+    import tasks
+
+    monkeypatch.setattr(tasks, "LOG_DIR", tmp_path)
+    etag = client.get("/api/state/logs").headers["ETag"]
+    assert client.post("/api/logs/clear").status_code == 200
+    assert _revalidate(client, "/api/state/logs", etag).status_code == 200
+
+
+def test_etag_changes_after_config_save(client, tmp_path, monkeypatch):
+    import web.routes
+
+    config_file = tmp_path / "config.toml"
+    config_file.write_text("[brush]\nmax_active_torrents = 5\n", encoding="utf-8")
+    monkeypatch.setattr(web.routes, "CONFIG_FILE_PATH", config_file)
+
+    etag = client.get("/api/state/torrents").headers["ETag"]
+    response = client.post(
+        "/api/config/update", json={"brush": {"max_active_torrents": 8}}
+    )
+    assert response.status_code == 200
+    assert "max_active_torrents = 8" in config_file.read_text(encoding="utf-8")
+    assert _revalidate(client, "/api/state/torrents", etag).status_code == 200
+
+
+def test_gzip_dynamic_responses_only(client):
+    gzip_headers = {"Accept-Encoding": "gzip"}
+    page = client.get("/state", headers=gzip_headers)
+    assert page.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in page.headers["Vary"]
+
+    static = client.get("/static/chart.js", headers=gzip_headers)
+    assert static.status_code == 200
+    assert "Content-Encoding" not in static.headers
+    assert "max-age" in static.headers["Cache-Control"]
+    static.close()
+
+    assert "Content-Encoding" not in client.get("/state").headers
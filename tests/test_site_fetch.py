@@ -0,0 +1,72 @@
+import ptsite
+from ptsite import BaseSiteSpider, SiteSessionPool
+
+
+class StubResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def request(self, *args, **kwargs):
+        return self.responses.pop(0)
+
+
+class StubLimiter:
+    def __init__(self):
+        self.paused = []
+
+    def acquire(self):
+        return 0
+
+    def pause(self, seconds):
+        self.paused.append(seconds)
+
+
+def test_session_pool_replaces_session_on_resize():
+    pool = SiteSessionPool()
+    session = pool.get("site", 4)
+    assert pool.get("site", 4) is session
+    assert pool.get("other", 4) is not session
+
+    closed = []
+    session.close = lambda: closed.append(True)
+    resized = pool.get("site", 8)
+    assert resized is not session
+    assert closed == [True]
+    assert pool.get("site", 8) is resized
+
+
+def test_fetch_closes_retried_responses(monkeypatch):
+    monkeypatch.setattr(ptsite, "sleep", lambda seconds: None)
+    spider = BaseSiteSpider(cookie="", max_retries=3)
+    failed = StubResponse(502)
+    limited = StubResponse(429, {"Retry-After": "5"})
+    ok = StubResponse(200)
+    spider.session = StubSession(failed, limited, ok)
+    spider.rate_limiter = StubLimiter()
+
+    assert spider.fetch("https://example.com") is ok
+    assert failed.closed and limited.closed
+    assert not ok.closed
+    assert spider.rate_limiter.paused == [5]
+
+
+def test_fetch_returns_last_failed_response(monkeypatch):
+    monkeypatch.setattr(ptsite, "sleep", lambda seconds: None)
+    spider = BaseSiteSpider(cookie="", max_retries=1)
+    responses = [StubResponse(500), StubResponse(503)]
+    spider.session = StubSession(*responses)
+    spider.rate_limiter = StubLimiter()
+
+    assert spider.fetch("https://example.com") is responses[1]
+    assert responses[0].closed
+    assert not responses[1].closed
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+import json
+
+from db import QBStatus, SystemMessage, TorrentEvent
+from stats import DashboardStats
+
+
+def test_event_counts_survive_log_cleanup(temp_db):
+    now = datetime.now()
+    QBStatus.create(up_total_size=100, dl_total_size=50)
+    for hours in (1, 30, 100, 200):
+        TorrentEvent.create(category="ADD_TORRENT", created_time=now - timedelta(hours=hours))
+    TorrentEvent.create(category="DELETE_TORRENT", created_time=now - timedelta(hours=50))
+    # Logs are trimmed to 24h and may be cleared at any time
+    SystemMessage.delete().execute()
+
+    stats = DashboardStats()
+    periods = json.loads(stats.payload())["period_stats"]
+    assert periods["1d"]["added_count"] == 1
+    assert periods["3d"]["added_count"] == 2
+    assert periods["7d"]["added_count"] == 3
+    assert periods["1d"]["deleted_count"] == 0
+    assert periods["3d"]["deleted_count"] == 1
+
+    stats.on_rows_written(
+        [(TorrentEvent, {"category": "DELETE_TORRENT", "created_time": now})]
+    )
+    periods = json.loads(stats.payload())["period_stats"]
+    assert periods["1d"]["deleted_count"] == 1
+    assert periods["7d"]["deleted_count"] == 2
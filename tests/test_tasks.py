@@ -0,0 +1,42 @@
+import pytest
+
+import tasks
+from events import event_broker
+
+
+class FailingService:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise RuntimeError("qb went away")
+
+        return fail
+
+
+@pytest.mark.parametrize(
+    "job, service",
+    [
+        (tasks.fetch_pt_torrents, "PtTorrentService"),
+        (tasks.clean_long_time_no_activate_torrents, "QBTorrentService"),
+        (tasks.clean_will_expire_torrents, "QBTorrentService"),
+        (tasks.check_disk_space_and_cleanup, "QBTorrentService"),
+        (tasks.brush, "BrushService"),
+    ],
+)
+def test_failed_job_still_notifies(monkeypatch, job, service):
+    monkeypatch.setattr(tasks, service, FailingService)
+    before = event_broker.etag("torrents")
+    # catch_error swallows the error
+    assert job() is None
+    assert event_broker.etag("torrents") != before
+
+
+def test_failed_qb_fetch_still_notifies(monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(tasks, "QBTorrentService", FailingService)
+    monkeypatch.setattr(
+        tasks.dashboard_stats, "refresh_active_count", lambda: refreshed.append(True)
+    )
+    before = event_broker.etag("torrents")
+    tasks.fetch_qb_torrents()
+    assert refreshed == [True]
+    assert event_broker.etag("torrents") != before
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import hashlib
+
+import pytest
+
+from db import TorrentFileCache
+from torrent_cache import TorrentCache
+
+
+@pytest.fixture
+def cache(temp_db, tmp_path):
+    return TorrentCache(root=tmp_path / "torrent_cache")
+
+
+def _age(site, torrent_id, minutes):
+    TorrentFileCache.update(last_used=datetime.now() - timedelta(minutes=minutes)).where(
+        (TorrentFileCache.site == site) & (TorrentFileCache.torrent_id == torrent_id)
+    ).execute()
+
+
+def test_content_addressed_storage(cache):
+    content = b"d4:infod4:name1:aee"
+    sha1 = hashlib.sha1(content).hexdigest()
+    cache.put("mteam", "1", content, max_size=1000)
+    # The same file under another id is stored once
+    cache.put("mteam", "2", content, max_size=1000)
+
+    path = cache.root / sha1[:2] / f"{sha1}.torrent"
+    assert path.read_bytes() == content
+    assert list(cache.root.rglob("*.torrent")) == [path]
+    assert cache.get("mteam", "1") == content
+    assert cache.get("mteam", "2") == content
+    assert cache.get("mteam", "3") is None
+    assert cache.get("other", "1") is None
+
+
+def test_disabled_or_oversized(cache):
+    cache.put("mteam", "1", b"x" * 10, max_size=0)
+    cache.put("mteam", "2", b"x" * 10, max_size=5)
+    assert TorrentFileCache.select().count() == 0
+    assert not cache.root.exists()
+
+
+def test_lru_eviction(cache):
+    cache.put("mteam", "1", b"a" * 40, max_size=100)
+    cache.put("mteam", "2", b"b" * 40, max_size=100)
+    _age("mteam", "1", 10)
+    _age("mteam", "2", 5)
+    # Using 1 makes 2 the least recently used
+    assert cache.get("mteam", "1")
+
+    cache.put("mteam", "3", b"c" * 40, max_size=100)
+    assert cache.get("mteam", "2") is None
+    assert cache.get("mteam", "1") == b"a" * 40
+    assert cache.get("mteam", "3") == b"c" * 40
+    assert len(list(cache.root.rglob("*.torrent"))) == 2
+
+
+def test_eviction_keeps_shared_files(cache):
+    cache.put("mteam", "1", b"a" * 40, max_size=100)
+    cache.put("mteam", "2", b"a" * 40, max_size=100)
+    cache.put("mteam", "3", b"b" * 40, max_size=100)
+    _age("mteam", "1", 10)
+
+    cache.put("mteam", "4", b"c" * 40, max_size=100)
+    # The oldest entry shares its file with 2, so dropping it freed nothing
+    assert cache.get("mteam", "1") is None
+    assert cache.get("mteam", "2") is None
+    assert cache.get("mteam", "3") == b"b" * 40
+    assert cache.get("mteam", "4") == b"c" * 40
+
+
+def test_missing_file_drops_index_row(cache):
+    content = b"torrent"
+    cache.put("mteam", "1", content, max_size=1000)
+    for path in cache.root.rglob("*.torrent"):
+        path.unlink()
+
+    assert cache.get("mteam", "1") is None
+    assert TorrentFileCache.select().count() == 0
+    # Can be cached again
+    cache.put("mteam", "1", content, max_size=1000)
+    assert cache.get("mteam", "1") == content
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from db import SiteWatermark
+from model import Watermark
+from ptsite.mteam import MTeamSpider
+from tasks.services import PtTorrentService
+
+BASE = datetime(2026, 10, 1, 12, 0, 0)
+BODY = {"mode": "normal", "pageSize": 200}
+
+
+def _item(torrent_id):
+    # Newer ids were uploaded later, none of them are free
+    return {
+        "id": torrent_id,
+        "created_time": BASE + timedelta(minutes=torrent_id),
+        "discount": "NORMAL",
+        "mall_single_free_status": None,
+        "free_end_time": None,
+    }
+
+
+def _spider(monkeypatch, pages, **kwargs):
+    spider = MTeamSpider(cookie="", **kwargs)
+    requested = []
+
+    def search(body):
+        requested.append(body["pageNumber"])
+        return pages[body["pageNumber"] - 1]
+
+    monkeypatch.setattr(spider, "_search", search)
+    return spider, requested
+
+
+def _page_of(first_id, size=MTeamSpider.INCREMENTAL_PAGE_SIZE):
+    return [_item(torrent_id) for torrent_id in range(first_id, first_id - size, -1)]
+
+
+WATERMARK = Watermark(torrent_id=10, created_time=BASE + timedelta(minutes=10))
+
+
+def test_incremental_scan_reaching_watermark_is_complete(monkeypatch):
+    spider, requested = _spider(
+        monkeypatch, [_page_of(100)[:40] + _page_of(10)[:10]], min_page_yield=0
+    )
+    page = spider._search_category(BODY, WATERMARK)
+    assert requested == [1]
+    assert page.complete and not page.full
+    assert page.items == 40
+    assert page.watermark.torrent_id == 100
+
+
+@pytest.mark.parametrize(
+    "pages, kwargs",
+    [
+        # Nothing on the first page is a candidate
+        ([_page_of(200), _page_of(150)], {}),
+        # Page limit reached before the watermark
+        ([_page_of(200), _page_of(150)], {"max_search_pages": 2, "min_page_yield": 0}),
+        # The second page failed
+        ([_page_of(200), None], {"min_page_yield": 0}),
+    ],
+)
+def test_incremental_scan_stopping_early_is_incomplete(monkeypatch, pages, kwargs):
+    spider, _ = _spider(monkeypatch, pages, **kwargs)
+    page = spider._search_category(BODY, WATERMARK)
+    assert not page.failed
+    assert not page.complete
+    assert page.watermark.torrent_id == 200
+
+
+def test_incomplete_incremental_scan_keeps_watermark(temp_db, monkeypatch):
+    spider, _ = _spider(monkeypatch, [_page_of(200)])
+    refreshed = datetime.now() - timedelta(hours=1)
+    SiteWatermark.create(
+        site="mteam",
+        category="normal",
+        newest_torrent_id=WATERMARK.torrent_id,
+        newest_created_time=WATERMARK.created_time,
+        last_full_refresh=refreshed,
+    )
+
+    PtTorrentService()._save_watermark("mteam", spider._search_category(BODY, WATERMARK))
+    mark = SiteWatermark.get()
+    assert mark.newest_torrent_id == WATERMARK.torrent_id
+    assert mark.newest_created_time == WATERMARK.created_time
+    # The gap is picked up by a full search on the next run
+    assert mark.last_full_refresh is None
+
+    spider, _ = _spider(monkeypatch, [_page_of(300, 10)])
+    PtTorrentService()._save_watermark("mteam", spider._search_category(BODY, None))
+    mark = SiteWatermark.get()
+    assert mark.newest_torrent_id == 300
+    assert mark.last_full_refresh is not None